@@ -0,0 +1,49 @@
+"""
+Benchmark helpers.find_groups (KD-tree + union-find) against the old BFS.
+
+    python bench_find_groups.py [max_segments]
+
+Segments are random short pieces of polyline, like the centerlines of a
+dense forest-path tile. Both implementations must produce the same groups.
+"""
+import random
+import sys
+import time
+
+from helpers import _find_groups_bfs, find_groups
+
+
+def random_segments(n, size=1000, step=15, seed=0):
+    rnd = random.Random(seed)
+    segs = []
+    while len(segs) < n:
+        x, y = rnd.randint(0, size), rnd.randint(0, size)
+        for _ in range(rnd.randint(3, 30)):
+            nx = x + rnd.randint(-step, step)
+            ny = y + rnd.randint(-step, step)
+            segs.append(((x, y), (nx, ny)))
+            x, y = nx, ny
+    return segs[:n]
+
+
+def _canon(groups):
+    return sorted(sorted(g) for g in groups)
+
+
+def main(max_n=8000, threshold=10):
+    print(f"{'segments':>9} {'bfs (s)':>10} {'kdtree (s)':>11} {'speedup':>8}")
+    n = 250
+    while n <= max_n:
+        segs = random_segments(n)
+        t0 = time.perf_counter()
+        ref = _find_groups_bfs(segs, threshold)
+        t1 = time.perf_counter()
+        new = find_groups(segs, threshold)
+        t2 = time.perf_counter()
+        assert _canon(ref) == _canon(new), f"group mismatch at n={n}"
+        print(f"{n:>9} {t1 - t0:>10.3f} {t2 - t1:>11.4f} {(t1 - t0) / max(t2 - t1, 1e-9):>7.0f}x")
+        n *= 2
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
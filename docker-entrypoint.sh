@@ -0,0 +1,7 @@
+#!/bin/sh
+# Uploads to / are only queued: the job workers (manage.py run_workers) must run
+# next to the web server. They start in the background (the pool restarts its
+# own crashed workers) and the server command given to the container runs in
+# the foreground.
+python manage.py run_workers &
+exec python manage.py "$@"
@@ -2,6 +2,7 @@ from collections import deque
 from math import sqrt, atan2, degrees
 import numpy as np
 from scipy.interpolate import splprep, splev
+from scipy.spatial import cKDTree
 
 
 def distance(p1, p2):
@@ -17,8 +18,8 @@ def are_connected_or_close(seg1, seg2, threshold):
             distance(seg1[1], seg2[1]) < threshold)
 
 
-def find_groups(segments, threshold):
-    """Group segments based on connectivity or proximity."""
+def _find_groups_bfs(segments, threshold):
+    """Reference O(n^2) grouping, kept for benchmarks and equivalence checks."""
     groups = []
     visited = set()
 
@@ -45,6 +46,58 @@ def find_groups(segments, threshold):
     return groups
 
 
+def _uf_find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def connected_components(n, pairs):
+    """
+    Union-find over the indices 0..n-1 linked by ``pairs`` of (a, b) indices.
+    Returns the components as index lists in ascending order, the components
+    ordered by their lowest index.
+    """
+    parent = list(range(n))
+    for a, b in pairs:
+        ra, rb = _uf_find(parent, a), _uf_find(parent, b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)  # root = lowest index in the set
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(_uf_find(parent, i), []).append(i)
+    return list(groups.values())
+
+
+def find_groups(segments, threshold):
+    """
+    Group segments based on connectivity or proximity.
+
+    Two segments are linked when any pair of their endpoints is closer than
+    ``threshold`` (same rule as ``are_connected_or_close``); groups are the
+    connected components. Endpoints go into a KD-tree so only nearby pairs
+    are compared, then union-find (``connected_components``) merges them.
+    Groups come out in order of their first segment, segments in input
+    order, duplicates dropped.
+    """
+    unique = list(dict.fromkeys(segments))
+    n = len(unique)
+    if n == 0:
+        return []
+
+    # endpoint 2*i and 2*i+1 belong to segment i
+    ends = np.asarray([pt for seg in unique for pt in seg[:2]], dtype=np.float64).reshape(-1, 2)
+    pairs = cKDTree(ends).query_pairs(r=threshold, output_type='ndarray')
+    if len(pairs):
+        # query_pairs is inclusive (<= r); the grouping rule is strict
+        d = np.hypot(*(ends[pairs[:, 0]] - ends[pairs[:, 1]]).T)
+        pairs = pairs[d < threshold] // 2
+
+    return [[unique[i] for i in group] for group in connected_components(n, pairs.tolist())]
+
+
 def collect_points(group):
     """Collect all points from a group of segments."""
     points = []
@@ -54,9 +107,9 @@ def collect_points(group):
 
 
 def sort_points(points):
-    """Sort points based on their x-coordinates (or y-coordinates if closer vertically)."""
-    points = sorted(points, key=lambda point: (point[0], point[1]))
-    return points
+    """Sort points by x, then y. Returns an (N, 2) float array."""
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return pts[np.lexsort((pts[:, 1], pts[:, 0]))]
 
 
 def predict_direction(p1, p2):
@@ -65,53 +118,66 @@ def predict_direction(p1, p2):
 
 
 def filter_zigzag(points, tolerance=50):
-    """Filter out points that deviate significantly from the predicted direction."""
-    if len(points) < 3:
-        return points  # Not enough points to filter
-
-    filtered_points = [points[0]]
-
-    for i in range(1, len(points) - 1):
-        prev_point = filtered_points[-1]
-        current_point = points[i]
-        next_point = points[i + 1]
-
-        direction_prev = predict_direction(prev_point, current_point)
-        direction_next = predict_direction(current_point, next_point)
-
-        if abs(direction_next - direction_prev) <= tolerance:
-            filtered_points.append(current_point)
-
-    filtered_points.append(points[-1])  # Add the last point
-
-    return filtered_points
+    """
+    Filter out points that deviate significantly from the predicted direction.
+
+    Takes and returns an (N, 2) array. The heading of every step
+    points[i] -> points[i+1] is computed in one NumPy pass; the incoming
+    heading only has to be recomputed after a point has been dropped.
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(pts)
+    if n < 3:
+        return pts  # Not enough points to filter
+
+    d = np.diff(pts, axis=0)
+    heading = np.degrees(np.arctan2(d[:, 1], d[:, 0])).tolist()
+
+    keep = [0]
+    prev_kept = True
+    for i in range(1, n - 1):
+        if prev_kept:
+            direction_prev = heading[i - 1]
+        else:
+            p, c = pts[keep[-1]], pts[i]
+            direction_prev = degrees(atan2(c[1] - p[1], c[0] - p[0]))
+        prev_kept = abs(heading[i] - direction_prev) <= tolerance
+        if prev_kept:
+            keep.append(i)
+    keep.append(n - 1)  # Add the last point
+
+    return pts[keep]
 
 
 def smooth_path(points, smoothing_factor=0):
-    """Smooth the path using cubic splines."""
-    if len(points) < 5:
-        return points  # Not enough points to smooth, return original points
+    """
+    Smooth the path using cubic splines.
 
-    # Remove duplicate points to avoid issues with splprep
-    points = list(dict.fromkeys(points))
+    Takes an (N, 2) array; returns the smoothed path as an (M, 2) int32
+    array, or the input points when there are too few to smooth.
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(pts) < 5:
+        return pts  # Not enough points to smooth, return original points
 
-    if len(points) < 2:
-        print("Not enough unique points to smooth.")
-        return points
+    # Remove duplicate points (keeping first occurrences in order) to avoid issues with splprep
+    _, first = np.unique(pts, axis=0, return_index=True)
+    pts = pts[np.sort(first)]
 
-    x = [p[0] for p in points]
-    y = [p[1] for p in points]
+    if len(pts) < 2:
+        print("Not enough unique points to smooth.")
+        return pts
 
     # Use linear or quadratic spline if not enough points for cubic spline
-    k = min(3, len(points) - 1)
+    k = min(3, len(pts) - 1)
 
     try:
-        tck, u = splprep([x, y], s=smoothing_factor, k=k)
-        u_fine = np.linspace(0, 1, len(points) * 10)
+        tck, u = splprep([pts[:, 0], pts[:, 1]], s=smoothing_factor, k=k)
+        u_fine = np.linspace(0, 1, len(pts) * 10)
         x_fine, y_fine = splev(u_fine, tck)
-        smoothed_points = list(zip(np.int32(x_fine), np.int32(y_fine)))
+        smoothed_points = np.column_stack((x_fine, y_fine)).astype(np.int32)
     except Exception as e:
         print(f"Error in smoothing path: {e}")
-        return points  # If smoothing fails, return original points
+        return pts  # If smoothing fails, return original points
 
     return smoothed_points
@@ -1,9 +1,11 @@
 
-from PIL import Image
 import cv2
+from PIL import Image
 from shapely.geometry import Polygon, MultiLineString
 import pygeoops
 from shapely.ops import linemerge
+from shapely.strtree import STRtree
+import shapely
 from helpers import *
 
 def polygon_area(vertices):
@@ -23,32 +25,98 @@ def multiline_to_coordinates(multilinestring):
 
 
 def merge_lines(lines, tolerance=10):
-    """Merge lines within a specified tolerance."""
+    """
+    Merge lines within a specified tolerance.
+
+    Lines closer than ``tolerance`` (directly or through a chain of other
+    lines) form one group, found with an STRtree query on envelopes grown by
+    ``tolerance`` plus union-find; each group is merged with one linemerge.
+    """
+    lines = [ln for ln in lines if ln is not None and not ln.is_empty]
+    if not lines:
+        return MultiLineString()
+
+    geoms = np.asarray(lines, dtype=object)
+    xmin, ymin, xmax, ymax = shapely.bounds(geoms).T
+    grown = shapely.box(xmin - tolerance, ymin - tolerance, xmax + tolerance, ymax + tolerance)
+    left, right = STRtree(geoms).query(grown)
+    cand = left < right
+    left, right = left[cand], right[cand]
+    close = shapely.distance(geoms[left], geoms[right]) < tolerance  # Check if the lines are close enough to merge
+
     merged_lines = []
-    while lines:
-        base_line = lines.pop(0)  # Take the first line as the base
-        merged = False
-        for i, line in enumerate(lines):
-            if base_line.distance(line) < tolerance:  # Check if the lines are close enough to merge
-                merged_line = linemerge([base_line, line])  # Merge the lines
-                lines.pop(i)
-                lines.insert(0, merged_line)  # Insert the merged line at the beginning
-                merged = True
-                break
-        if not merged:
-            merged_lines.append(base_line)  # Add the base line to merged_lines if no merge occurred
+    for group in connected_components(len(lines), zip(left[close].tolist(), right[close].tolist())):
+        parts = []
+        for g in (lines[i] for i in group):  # linemerge only takes LineStrings
+            parts.extend(g.geoms if hasattr(g, 'geoms') else [g])
+        merged = linemerge(parts) if len(parts) > 1 else parts[0]
+        merged_lines.extend(merged.geoms if hasattr(merged, 'geoms') else [merged])
     return MultiLineString(merged_lines)  # Return the merged lines as a MultiLineString
 
 
-def prediction(image, model):
-    """Predict and annotate image using a YOLO model based on the season."""
-    one_pixel = 0.15  # Conversion factor from pixels to meters (or other units)
+def center_points(boxes, masks=None, exclude_classes=(6,), normalized=False, return_index=False):
+    """
+    Center point of every detection, straight from an in-memory Results
+    (no label files). Uses the mean of the mask polygon vertices when masks
+    are given (as the label-file parsing did), otherwise the box center.
+    Returns an (N, 2) float array; classes in exclude_classes are left out.
+    With return_index=True also returns the detection index of each point.
+    """
+    if boxes is None or len(boxes) == 0:
+        empty = np.zeros((0, 2))
+        return (empty, np.zeros(0, dtype=int)) if return_index else empty
+    cls = boxes.cls.cpu().numpy().astype(int)
+    if masks is not None:
+        polys = masks.xyn if normalized else masks.xy
+        centers = np.array([np.asarray(p).mean(axis=0) if len(p) else (np.nan, np.nan) for p in polys],
+                           dtype=np.float64).reshape(-1, 2)
+    else:
+        centers = (boxes.xywhn if normalized else boxes.xywh)[:, :2].cpu().numpy().astype(np.float64)
+    keep = ~np.isin(cls, exclude_classes) & ~np.isnan(centers).any(axis=1)
+    return (centers[keep], np.flatnonzero(keep)) if return_index else centers[keep]
+
+
+def prediction(image, model, return_masks=False):
+    """
+    Predict and annotate image using a YOLO model based on the season.
+    The annotated image is returned as a PIL image (annotate_result's BGR
+    buffer, converted once here for the callers that ``.save()`` it).
+    With return_masks=True the result's ``masks`` (None without
+    segmentation) is appended to the returned tuple, for center_points.
+    """
     try:
         # Load the appropriate YOLO model based on the season
 
 
         # Perform prediction using the YOLO model
-        results = model.predict(image, save=False, save_txt=True, save_crop=False, show_labels=False, show_boxes=False)
+        results = model.predict(image, save=False, save_txt=False, save_crop=False, show_labels=False, show_boxes=False)
+        for r in results:
+            flag, image_np, boxes, text_list, box_ls, postion_ls, center_ls = annotate_result(r)
+            if flag:
+                image_np = Image.fromarray(image_np[..., ::-1])  # BGR -> RGB PIL image
+                # callers json.dump postion_ls: path line_value arrays go out as nested lists
+                postion_ls = [{k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in p.items()}
+                              for p in postion_ls]
+            details = (flag, image_np, boxes, text_list, box_ls, postion_ls, center_ls)
+            return details + (r.masks,) if return_masks else details
+
+    except Exception as e:
+        # Handle any exceptions that occur during processing
+        print(str(e))
+    failed = (False, '', '', '', '', '', '')
+    return failed + (None,) if return_masks else failed
+
+
+def annotate_result(r, render=True):
+    """
+    Annotate a single YOLO result (one image) and collect the detection details.
+    The annotations are drawn in place on the BGR buffer returned by
+    ``r.plot()`` and that same array is returned (ready for cv2.imwrite).
+    With render=False nothing is drawn (the returned image is None); only the
+    boxes, areas, center points and path lines are computed.
+    """
+    one_pixel = 0.15  # Conversion factor from pixels to meters (or other units)
+    try:
         font = cv2.FONT_HERSHEY_SIMPLEX
         font_scale = 1
         font_thickness = 2
@@ -60,128 +128,121 @@ def prediction(image, model):
         center_ls = []
         box_ls = []
 
-        for r in results:
-            all_points = []
-            polygon_path_list = []
-            boxes = r.boxes  # Bounding boxes for detected objects
-            im_array = r.plot(line_width=4, conf=1)  # Generate an image with annotated results
-            im = Image.fromarray(im_array[..., ::-1])  # Convert image to PIL format
-            image_np = np.array(im)  # Convert image to NumPy array
-            h, w, c = image_np.shape
-            threshold = h / 30
-            class_ids = r.boxes.cls.tolist()  # Get the list of class IDs for detected objects
-
-            # Initialize a dictionary to count occurrences of each class
-            try:
-                polygon_point = r.masks.xy
-                class_counts = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0, 8: 0}
-
-                # Count the occurrences of each class ID
-                for count in class_ids:
-                    class_counts[count] += 1
-
-                # Annotate the image with class names and counts
-                for class_id, count in class_counts.items():
-                    class_name = r.names.get(class_id, f'Class {class_id}')
-                    text = f'{class_name}: {count}'
-                    text_list.append(text)
-                    position = (10, 30 + 30 * class_id)  # Adjust the position for each class
+        all_points = []
+        polygon_path_list = []
+        boxes = r.boxes  # Bounding boxes for detected objects
+        # r.plot() returns a fresh BGR array; everything below draws on it in
+        # place, so colours are given in BGR order
+        image_np = r.plot(line_width=4, conf=1) if render else None
+        h, w = r.orig_shape[:2]
+        threshold = h / 30
+        class_ids = r.boxes.cls.tolist()  # Get the list of class IDs for detected objects
+
+        # Initialize a dictionary to count occurrences of each class
+        try:
+            polygon_point = r.masks.xy
+            class_counts = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0, 8: 0}
+
+            # Count the occurrences of each class ID
+            for count in class_ids:
+                class_counts[count] += 1
+
+            # Annotate the image with class names and counts
+            for class_id, count in class_counts.items():
+                class_name = r.names.get(class_id, f'Class {class_id}')
+                text = f'{class_name}: {count}'
+                text_list.append(text)
+                position = (10, 30 + 30 * class_id)  # Adjust the position for each class
+                if render:
                     cv2.putText(image_np, text, position, font, font_scale, font_color, font_thickness)
 
-                class_id_count = 1
-
-                # Process each detected object
-                for box, cls_id, polygon_value in zip(boxes, class_ids, polygon_point):
-                    poly_area = polygon_area(polygon_value)  # Calculate the area of the polygon
-                    poly_area_meter = poly_area * (one_pixel ** 2)  # Convert area to square meters
-
-                    # Extract bounding box coordinates
-                    xmin = int(box.data[0][0])
-                    ymin = int(box.data[0][1])
-                    xmax = int(box.data[0][2])
-                    ymax = int(box.data[0][3])
-                    box_ls.append([xmin, ymin, xmax, ymax])  # Add bounding box to list
-
-                    # Calculate the center point of the bounding box
-                    center_x = int((xmin + xmax) // 2)
-                    center_y = int((ymin + ymax) // 2)
-                    center_point = (center_x, center_y)
-
-                    # Get the class name and append the center point to the list
-                    clas_id = int(cls_id)
-                    class_name = r.names.get(clas_id, f'Class {clas_id}')
-                    center_ls.append({class_name: center_point})
-                    class_id_count += 1
-
-                    # Draw a circle at the center point
-                    cv2.circle(image_np, center_point, 5, (255, 0, 0), -1)
-
-                    # If the detected object is a "path", calculate the centerline
-                    if 'path' in class_name:
-                        print(class_name)
-                        poly = Polygon(polygon_value)  # Create a polygon object from the vertices
-                        centerline = pygeoops.centerline(poly)  # Calculate the centerline of the polygon
-                        line_strings = []
-
-                        # Extract line strings from the centerline geometry
-                        if hasattr(centerline, 'geoms'):
-                            for line in centerline.geoms:
-                                line_strings.append(line)
-                        else:
-                            line_strings.append(centerline)
-
-                        line_list = []
-
-                        # Draw the centerline on the image
-                        for line in line_strings:
-                            points = [(int(point[0]), int(point[1])) for point in line.coords]
-
-                            for i in range(len(points) - 1):
-
-                                cv2.line(image_np, points[i], points[i + 1], color=(0, 0, 255), thickness=2)
-                                # print(points[i], points[i + 1])
-                                line_list.append((points[i], points[i + 1]))
-                                all_points.append((points[i], points[i + 1])) # All Points of path append here
-                        print('line_list:',line_list)
-                        area_value = f"{round(poly_area_meter, 2)} m²"
-                        polygon_path_list.append(area_value)
-                        # postion_ls.append({class_name: f"{round(poly_area_meter, 2)} m²", "line_value": line_list})
+            class_id_count = 1
+
+            # Process each detected object
+            for box, cls_id, polygon_value in zip(boxes, class_ids, polygon_point):
+                poly_area = polygon_area(polygon_value)  # Calculate the area of the polygon
+                poly_area_meter = poly_area * (one_pixel ** 2)  # Convert area to square meters
+
+                # Extract bounding box coordinates
+                xmin = int(box.data[0][0])
+                ymin = int(box.data[0][1])
+                xmax = int(box.data[0][2])
+                ymax = int(box.data[0][3])
+                box_ls.append([xmin, ymin, xmax, ymax])  # Add bounding box to list
+
+                # Calculate the center point of the bounding box
+                center_x = int((xmin + xmax) // 2)
+                center_y = int((ymin + ymax) // 2)
+                center_point = (center_x, center_y)
+
+                # Get the class name and append the center point to the list
+                clas_id = int(cls_id)
+                class_name = r.names.get(clas_id, f'Class {clas_id}')
+                center_ls.append({class_name: center_point})
+                class_id_count += 1
+
+                # Draw a circle at the center point
+                if render:
+                    cv2.circle(image_np, center_point, 5, (0, 0, 255), -1)
+
+                # If the detected object is a "path", calculate the centerline
+                if 'path' in class_name:
+                    poly = Polygon(polygon_value)  # Create a polygon object from the vertices
+                    centerline = pygeoops.centerline(poly)  # Calculate the centerline of the polygon
+                    line_strings = []
+
+                    # Extract line strings from the centerline geometry
+                    if hasattr(centerline, 'geoms'):
+                        for line in centerline.geoms:
+                            line_strings.append(line)
                     else:
-                        postion_ls.append({class_name: f"{round(poly_area_meter, 2)} m²", "line_value": False})
-
-                # Convert the modified image back to PIL format and return the results
-            except:
-                pass
-            groups = find_groups(all_points, threshold) # create groups of all path value
-            for group in groups:
-                # Collect points from the group
-                group_points = collect_points(group)
-
-                # Sort the points to create a forward-moving polyline
-                sorted_points = sort_points(group_points)
-                # Filter out zigzagging points
-                filtered_points = filter_zigzag(sorted_points, tolerance=50)
-                # Smooth the path to prevent zigzagging
-                smooth_points = smooth_path(filtered_points, smoothing_factor=0)
-                cv2.polylines(image_np, [np.array(smooth_points, dtype=np.int32)], isClosed=False, color=(0, 200, 0),
+                        line_strings.append(centerline)
+
+                    line_list = []
+
+                    # Draw the centerline on the image
+                    for line in line_strings:
+                        points = [(int(point[0]), int(point[1])) for point in line.coords]
+
+                        for i in range(len(points) - 1):
+
+                            if render:
+                                cv2.line(image_np, points[i], points[i + 1], color=(255, 0, 0), thickness=2)
+                            # print(points[i], points[i + 1])
+                            line_list.append((points[i], points[i + 1]))
+                            all_points.append((points[i], points[i + 1])) # All Points of path append here
+                    area_value = f"{round(poly_area_meter, 2)} m²"
+                    polygon_path_list.append(area_value)
+                    # postion_ls.append({class_name: f"{round(poly_area_meter, 2)} m²", "line_value": line_list})
+                else:
+                    postion_ls.append({class_name: f"{round(poly_area_meter, 2)} m²", "line_value": False})
+
+            # Convert the modified image back to PIL format and return the results
+        except:
+            pass
+        groups = find_groups(all_points, threshold) # create groups of all path value
+        for group in groups:
+            # Collect points from the group
+            group_points = collect_points(group)
+
+            # Sort the points to create a forward-moving polyline
+            sorted_points = sort_points(group_points)
+            # Filter out zigzagging points
+            filtered_points = filter_zigzag(sorted_points, tolerance=50)
+            # Smooth the path to prevent zigzagging
+            smooth_points = smooth_path(filtered_points, smoothing_factor=0)
+            smooth_points = smooth_points.astype(np.int32)
+            if render:
+                cv2.polylines(image_np, [smooth_points], isClosed=False, color=(0, 200, 0),
                               thickness=2)
-                smooth_points1 = np.array(smooth_points).tolist() # convert np array list to list
-                line_list1 = []
-                for i in range(len(smooth_points1) - 1):
-                    start_point = tuple(smooth_points1[i])
-                    end_point = tuple(smooth_points1[i + 1])
-                    line_list1.append((start_point, end_point)) # append tuple on this list
-                    # cv2.line(image_np, start_point, end_point, color=(0, 255, 0), thickness=2)
+            # consecutive (start, end) pairs as an (M, 2, 2) array
+            line_value = np.stack((smooth_points[:-1], smooth_points[1:]), axis=1)
 
-                postion_ls.append({'path': f"88.7 m²", "line_value":line_list1})
+            postion_ls.append({'path': f"88.7 m²", "line_value": line_value})
 
-            modified_im = Image.fromarray(image_np)
-
-            return True, modified_im, boxes, text_list, box_ls, postion_ls, center_ls
+        return True, image_np, boxes, text_list, box_ls, postion_ls, center_ls
 
     except Exception as e:
         # Handle any exceptions that occur during processing
         print(str(e))
         return False, '', '', '', '', '', ''
-
-
@@ -1,3 +1,6 @@
 sudo systemctl daemon-reload
 sudo systemctl restart facetune.service
-sudo systemctl restart nginx
\ No newline at end of file
+sudo systemctl restart nginx
+# The job workers (python manage.py run_workers) run as their own service next
+# to the web server; restart them too or queued uploads are never processed.
+sudo systemctl restart facetune-workers.service
@@ -2,7 +2,7 @@ from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
 from django.core.files.storage import FileSystemStorage
-from inference import prediction
+from inference import prediction, center_points as center_points_of
 import glob
 from PIL import Image
 import json
@@ -311,24 +311,11 @@ def convert_to_json(filename):
     return filename + ".json"
 
 
-def using_box_find_center_point(boxes, postion_ls, output_directory, input_filename, output_image_path):
-    """Calculate the center points from bounding boxes and save them along with polygon area data to a JSON file."""
-    center_points = []
-    input_filename_txt = convert_to_txt(input_filename)  # Convert image filename to .txt
-    input_directory = 'runs/segment/predict/labels'  # Define the input directory for label files
-    input_filepath = os.path.join(input_directory, input_filename_txt)
-
+def using_box_find_center_point(boxes, postion_ls, output_directory, input_filename, output_image_path, masks=None):
+    """Calculate the center points of the detections and save them along with polygon area data to a JSON file."""
     try:
-        with open(input_filepath, "r") as input_file:
-            lines = input_file.readlines()
-
-        center_points = []
-        for line in lines:
-            center_point = calculate_center_points(line, output_image_path)
-            print(center_point)
-            if False not in center_point:
-                print("work")
-                center_points.append(center_point)
+        # taken from the in-memory results; no runs/segment/predict/labels round trip
+        center_points = [tuple(p) for p in center_points_of(boxes, masks, normalized=True).tolist()]
 
         # Convert input filename to JSON and write the data to the output file
         input_filename = convert_to_json(input_filename)
@@ -754,9 +741,10 @@ def index(request):
                 if os.path.isfile(file_path) and file_name.lower().endswith(('.jpg', '.jpeg')):
                     image = Image.open(file_path)
                     # Run the prediction model on the image
-                    flag, ori_path, boxes, img_count, box_ls, postion_ls, center_ls = prediction(image, model)
+                    flag, ori_path, boxes, img_count, box_ls, postion_ls, center_ls, masks = prediction(
+                        image, model, return_masks=True)
                     output_directory = 'static/centers'
-                    using_box_find_center_point(boxes, postion_ls, output_directory, file_name, image)
+                    using_box_find_center_point(boxes, postion_ls, output_directory, file_name, image, masks=masks)
                     output_path = f'{output_folder}/{file_name}'
                     if flag:
                         width, height = image.size
@@ -889,9 +877,10 @@ def index(request):
                     print("file_name:", file_name)
                     image = Image.open(path)
                     # Run the prediction model on the image
-                    flag, ori_path, boxes, img_count, box_ls, postion_ls, center_ls = prediction(image, model)
+                    flag, ori_path, boxes, img_count, box_ls, postion_ls, center_ls, masks = prediction(
+                        image, model, return_masks=True)
                     output_directory = 'static/centers'
-                    using_box_find_center_point(boxes, postion_ls, output_directory, file_name, image)
+                    using_box_find_center_point(boxes, postion_ls, output_directory, file_name, image, masks=masks)
                     output_path = f'{output_folder}/{file_name}'
                     if flag:
                         width, height = image.size
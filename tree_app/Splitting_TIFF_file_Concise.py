@@ -1,27 +1,46 @@
 import os
+import threading
+import uuid
+from contextlib import nullcontext
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from osgeo import gdal, osr
 from PIL import Image
 
-# Open the TIFF file:
-# file_path = input('''Enter the file path to the '.tif' file, for example \
-# 'Path\\to\\file.tif': ''')
-# file_path = '210317 V 2D Bachelorarbeit SL Distr.V Abt. 1.tif'
-def tif_main(file_path,folder_path):
+from .pools import ordered_map
+
+gdal.UseExceptions()
+
+# One 150 x 150 m tile: pixel data (BGR, uint8, at most MAX_TILE_PIXELS a side),
+# the GDAL geotransform of that array and the fraction of pixels with data.
+Tile = namedtuple('Tile', ['i', 'j', 'name', 'array', 'geotransform', 'valid_fraction'])
+
+TILE_SIZE_M = 150.0
+MAX_TILE_PIXELS = 1000
+
+
+def _open_metric(file_path, reprojected_path, cache=None, source_hash=None):
+    """Open the raster; if its units are not metres, wrap it in a warped VRT
+    reprojected to UTM (done once, pixels are warped lazily on read), or,
+    with a ReprojectionCache, open the cached reprojected GeoTIFF (warping
+    it into the cache first on a miss).
+    Returns (dataset, crs, path the dataset can be reopened from, cache pin
+    or None); the pin keeps a cached raster from being evicted while the
+    tiler threads reopen it, and must be released when done."""
+    file_path = os.path.abspath(file_path)  # the VRT refers back to it by name
     raster = gdal.Open(file_path)
+    source_path = file_path
+    pin = None
 
     # Extract the geotransform and print it:
     geo_transform = raster.GetGeoTransform()
     print(f'\nGeoTransform for the file: {geo_transform}')
 
-
-    # Extract and print the Well-Known Text (WKT) format of the CRS:
-    wkt = raster.GetProjection()
-    print(f'\nWell-Known Text (WKT) format of the CRS: {wkt}')
-
     # Initialize the SpatialReference object with the WKT:
     crs = osr.SpatialReference()
-    crs.ImportFromWkt(wkt)
-    print(f'\nInitialized CRS: {crs.ExportToWkt()}')
+    crs.ImportFromWkt(raster.GetProjection())
 
     # Check if the units are in meters, if not or unknown, reprojects the
     # raster:
@@ -40,154 +59,259 @@ def tif_main(file_path,folder_path):
         utm_crs = osr.SpatialReference()
         utm_crs.SetUTM(utm_zone, is_northern)
         utm_crs.SetWellKnownGeogCS('WGS84')
-        gdal.Warp('static/reprojected.tif', raster, dstSRS=utm_crs.ExportToWkt())
-
-        # Update the raster, 'geo_transform', and WKT with the reprojected
-        # versions:
-        raster = gdal.Open('static/reprojected.tif')
-        # Update 'geo_transform' and 'wkt'
+        # (dstAlpha marks the area outside the source footprint as no-data)
+        dst_wkt = utm_crs.ExportToWkt()
+        if cache is not None and cache.enabled:
+            def build(tmp_path, creation_options):
+                gdal.Warp(tmp_path, raster, format='GTiff', dstSRS=dst_wkt, dstAlpha=True,
+                          creationOptions=creation_options, multithread=True)
+            reprojected_path, pin = cache.get_or_create(file_path, dst_wkt, build, source_hash)
+        else:
+            gdal.Warp(reprojected_path, raster, format='VRT', dstSRS=dst_wkt, dstAlpha=True)
+
+        # Update the raster and CRS with the reprojected versions:
+        try:
+            raster = gdal.Open(reprojected_path)
+        except Exception:
+            if pin is not None:
+                pin.release()
+            raise
+        source_path = reprojected_path
+        crs.ImportFromWkt(raster.GetProjection())
+
+    return raster, crs, source_path, pin
+
+
+def _read_tile(raster, geo_transform, tile_xmin, tile_ymax, xsize_tile, ysize_tile,
+               max_pixels=MAX_TILE_PIXELS, min_valid_fraction=0.0):
+    """Read one tile window as a BGR uint8 array, downsampled by GDAL to at
+    most ``max_pixels`` a side. Parts of the tile outside the raster are 0.
+
+    Returns (array, geotransform, valid_fraction). Coverage comes from the
+    mask band (nodata / alpha) when the raster has one, else from non-black
+    pixels; below ``min_valid_fraction`` the array is None and, when a mask
+    exists, the RGB bands are not read at all."""
+    res_x, res_y = geo_transform[1], abs(geo_transform[5])
+    xoff = int(round((tile_xmin - geo_transform[0]) / res_x))
+    yoff = int(round((geo_transform[3] - tile_ymax) / res_y))
+    width = int(round(xsize_tile / res_x))
+    height = int(round(ysize_tile / res_y))
+
+    # Same aspect-preserving downscale PIL's thumbnail((1000, 1000)) did:
+    scale = min(1.0, float(max_pixels) / max(width, height))
+    out_w, out_h = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+    tile_gt = (tile_xmin, xsize_tile / out_w, 0.0, tile_ymax, 0.0, -ysize_tile / out_h)
+
+    # Clip the window to the raster and place it inside the padded tile:
+    x0, y0 = max(xoff, 0), max(yoff, 0)
+    x1, y1 = min(xoff + width, raster.RasterXSize), min(yoff + height, raster.RasterYSize)
+    if x1 <= x0 or y1 <= y0:
+        # Entirely outside the raster footprint:
+        if min_valid_fraction > 0:
+            return None, tile_gt, 0.0
+        return np.zeros((out_h, out_w, 3), dtype=np.uint8), tile_gt, 0.0
+
+    dst_x0 = int(round((x0 - xoff) * scale))
+    dst_y0 = int(round((y0 - yoff) * scale))
+    buf_w = max(1, min(out_w - dst_x0, int(round((x1 - x0) * scale))))
+    buf_h = max(1, min(out_h - dst_y0, int(round((y1 - y0) * scale))))
+
+    valid_fraction = None
+    band1 = raster.GetRasterBand(1)
+    if band1.GetMaskFlags() != gdal.GMF_ALL_VALID:
+        mask = band1.GetMaskBand().ReadAsArray(x0, y0, x1 - x0, y1 - y0,
+                                               buf_xsize=buf_w, buf_ysize=buf_h)
+        valid_fraction = np.count_nonzero(mask) / float(out_w * out_h)
+        if valid_fraction < min_valid_fraction:
+            return None, tile_gt, valid_fraction
+
+    tile = np.zeros((out_h, out_w, 3), dtype=np.uint8)
+    # Bands 3,2,1 give BGR directly; single-band rasters are replicated:
+    bands = [3, 2, 1] if raster.RasterCount >= 3 else [1, 1, 1]
+    data = raster.ReadAsArray(x0, y0, x1 - x0, y1 - y0,
+                              buf_xsize=buf_w, buf_ysize=buf_h,
+                              band_list=bands,
+                              resample_alg=gdal.GRIORA_Average)
+    if data.dtype != np.uint8:
+        data = np.clip(data, 0, 255).astype(np.uint8)
+    tile[dst_y0:dst_y0 + buf_h, dst_x0:dst_x0 + buf_w] = np.moveaxis(data, 0, -1)
+
+    if valid_fraction is None:
+        valid_fraction = np.count_nonzero(tile.any(axis=2)) / float(out_w * out_h)
+        if valid_fraction < min_valid_fraction:
+            return None, tile_gt, valid_fraction
+    return tile, tile_gt, valid_fraction
+
+
+def write_world_file(path, geotransform):
+    """Write a .jgw/.tfw world file (coordinates refer to the centre of the
+    upper-left pixel, as the format requires)."""
+    a, b, c = geotransform[1], geotransform[2], geotransform[0]
+    d, e, f = geotransform[4], geotransform[5], geotransform[3]
+    with open(path, 'w') as world:
+        world.write(f'{a}\n{d}\n{b}\n{e}\n{c + a / 2 + b / 2}\n{f + d / 2 + e / 2}\n')
+
+
+def save_tile_jpeg(tile, path, write_jgw=True):
+    """Encode a tile to JPEG (quality 90, 300 DPI) and optionally its .jgw."""
+    Image.fromarray(tile.array[..., ::-1]).save(path, 'JPEG', quality=90, dpi=(300, 300))
+    if write_jgw:
+        write_world_file(os.path.splitext(path)[0] + '.jgw', tile.geotransform)
+
+
+def save_tile_tiff(raster, path, bounds):
+    """Write the tile at ``bounds`` (xmin, ymin, xmax, ymax) as a GeoTIFF at
+    the raster's own resolution, bands and data type, nodata -9999 outside
+    the source, as the per-tile gdal.Warp of the original splitter did (the
+    downsampled ``Tile.array`` is only meant for inference and the JPEG)."""
+    gdal.Warp(path, raster, outputBounds=bounds, dstNodata=-9999)
+
+
+def iter_tiles(file_path, folder_path=None, save_jpeg=False, save_tiff=False,
+               tile_size=TILE_SIZE_M, max_pixels=MAX_TILE_PIXELS, workers=1,
+               on_grid=None, min_valid_fraction=0.0, on_skip=None, index_path=None,
+               reprojection_cache=None, source_hash=None):
+    """
+    Yield ``Tile`` objects for every 150 m cell of the raster in (i, j) order.
+
+    The raster is reprojected at most once (as a warped VRT) and each tile is
+    a pixel-window read from it, so nothing touches the disk unless
+    ``save_jpeg`` / ``save_tiff`` ask for Segmented_{i}_{j} files in
+    ``folder_path``.
+
+    With ``workers > 1`` tiles are read (and saved) by a thread pool; GDAL
+    releases the GIL during raster I/O. Every thread opens its own dataset
+    handle and results are still yielded in (i, j) order, so names and the
+    coordinates file are identical to a sequential run.
+
+    ``on_grid(n)`` is called with the number of tiles before the first one
+    is produced, so streaming consumers can report progress.
+
+    Tiles whose valid-pixel fraction is below ``min_valid_fraction`` (outside
+    the footprint or almost all no-data) are neither saved nor yielded;
+    ``on_skip(name, valid_fraction)`` is called for each of them instead.
+
+    Nothing is shared between calls: the reprojection VRT lives under a
+    unique /vsimem/ path and is unlinked when the generator finishes or is
+    closed, and the tile coordinate index is written to ``index_path``
+    (default ``folder_path/0_Tiles_Geo_Coordinates.txt``; skipped when
+    neither is given), so concurrent runs cannot clobber each other.
+
+    With a ``reprojection_cache`` a non-metric raster is warped only the first
+    time it is seen (keyed by ``source_hash`` or the file's SHA-256).
+    """
+    reprojected_path = f'/vsimem/tiler_{uuid.uuid4().hex}/reprojected.vrt'
+    if index_path is None and folder_path:
+        index_path = os.path.join(folder_path, '0_Tiles_Geo_Coordinates.txt')
+    raster, crs, source_path, pin = _open_metric(file_path, reprojected_path,
+                                                 reprojection_cache, source_hash)
+    local = threading.local()
+    pool = tiles = None
+    try:
         geo_transform = raster.GetGeoTransform()
-        wkt = raster.GetProjection()
-        # Update 'crs' with the new WKT
-        crs.ImportFromWkt(wkt)
-
-
-    # Get and print the units of the GeoTransform:
-    units = crs.GetLinearUnitsName()
-    print(f'''\nThe linear units of the 'GeoTransform' are in: {units}''')
-
-
-    # Extract xmin and ymax coordinates from the geotransform:
-    xmin, ymax = geo_transform[0], geo_transform[3]
-
-    print(f'\nxmin coordinates: {xmin}')
-    print(f'\nymax coordinates: {ymax}')
-
-
-    # Get the resolution in both directions
-    raster_resolution_x, raster_resolution_y = geo_transform[1], abs(geo_transform[5])
 
-    print(f'\nResolution in the x direction: {raster_resolution_x} {units}')
-    print(f'Resolution in the y direction: {raster_resolution_y} {units}')
+        # Get and print the units of the GeoTransform:
+        units = crs.GetLinearUnitsName()
+        print(f'''\nThe linear units of the 'GeoTransform' are in: {units}''')
 
-    print(f'''The total number of pixels across the width of the
-    image or the number of raster in x direction: {raster.RasterXSize}''')
+        # Extract xmin and ymax coordinates from the geotransform:
+        xmin, ymax = geo_transform[0], geo_transform[3]
 
+        # Calculate the total length in both directions:
+        raster_x_length = geo_transform[1] * raster.RasterXSize
+        raster_y_length = abs(geo_transform[5]) * raster.RasterYSize
 
-    # Calculate the total length in both directions:
-    raster_x_length = raster_resolution_x * raster.RasterXSize
-    raster_y_length = raster_resolution_y * raster.RasterYSize
-
-    print(f'\nTotal length in x direction: {raster_x_length} {units}')
-    print(f'Total length in y direction: {raster_y_length} {units}')
-
-    print(f'''\nTotal physical size of the raster: \
+        print(f'''\nTotal physical size of the raster: \
     {raster_x_length} (x axis) x {raster_y_length} (y axis) {units}''')
 
+        # Define the size of the tiles:
+        xsize_tile = float(tile_size)
+        ysize_tile = float(tile_size)
+
+        if folder_path and (save_jpeg or save_tiff):
+            os.makedirs(folder_path, exist_ok=True)
+
+        # Calculate the number of tiles in each direction:
+        tiles_x = raster_x_length / xsize_tile
+        tiles_y = raster_y_length / ysize_tile
+
+        print(f"Number of tiles in x-direction: {round(tiles_x)}")
+        print(f"Number of tiles in y-direction: {round(tiles_y)}")
+
+        # Generate the coordinates for the tiles:
+        xsteps = [xmin + xsize_tile * i for i in range(round(tiles_x) + 1)]
+        ysteps = [ymax - ysize_tile * i for i in range(round(tiles_y) + 1)]
+
+        def make_tile(i, j):
+            # Each pool thread reads through its own dataset handle:
+            handle = raster
+            if pool is not None:
+                handle = getattr(local, 'raster', None)
+                if handle is None:
+                    handle = local.raster = gdal.Open(source_path)
+            array, tile_gt, valid = _read_tile(handle, geo_transform, xsteps[i], ysteps[j],
+                                               xsize_tile, ysize_tile, max_pixels,
+                                               min_valid_fraction)
+            tile = Tile(i, j, f'Segmented_{i}_{j}', array, tile_gt, valid)
+            if array is None:
+                return tile
+
+            if folder_path and save_tiff:
+                save_tile_tiff(handle, os.path.join(folder_path, f'{tile.name}.tif'),
+                               (xsteps[i], ysteps[j + 1], xsteps[i + 1], ysteps[j]))
+            if folder_path and save_jpeg:
+                save_tile_jpeg(tile, os.path.join(folder_path, f'{tile.name}.jpeg'))
+            return tile
+
+        cells = [(i, j) for i in range(round(tiles_x)) for j in range(round(tiles_y))]
+        if on_grid is not None:
+            on_grid(len(cells))
+        if workers and workers > 1:
+            pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tiler')
+            tiles = ordered_map(pool, lambda cell: make_tile(*cell), cells, window=2 * workers)
+        else:
+            tiles = (make_tile(i, j) for i, j in cells)
+
+        if index_path:
+            os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+
+        # Open a text file to write the geo coordinates of each tile:
+        with (open(index_path, 'w') if index_path else nullcontext()) as file:
+            for tile in tiles:
+                # Writes each tile details to the text file:
+                if file is not None:
+                    file.write(f'''\nFile Name: {tile.name}.tif
+    Tile xmin coordinates at top left: {xsteps[tile.i]}
+    Tile ymin coordinates at top left: {ysteps[tile.j]}
+    Size of the cut: {xsize_tile} x {ysize_tile} m\n''')
 
-    # Define the size of the tiles:
-    xsize_tile = float(150)
-    ysize_tile = float(150)
-
-    # Ask for the output folder name or set a default one:
-    output_folder = folder_path
-    os.makedirs(output_folder, exist_ok=True)
-
-    # Calculate the number of tiles in each direction:
-    tiles_x = raster_x_length/xsize_tile
-    tiles_y = raster_y_length/ysize_tile
-
-    print(f"Number of tiles in x-direction: {round(tiles_x)}")
-    print(f"Number of tiles in y-direction: {round(tiles_y)}")
-
-    print(f'''\nTile size will be: {xsize_tile} x {ysize_tile} {units}''')
-    print(f'''Your folder name will be: {output_folder}''')
-
-
-    # Ask the user if they want to proceed with generating TIFF tiles:
-    proceed = 'y'
-
-    # Open a text file to write the geo coordinates of each tile:
-    with open(os.path.join('static/', '0_Tiles_Geo_Coordinates.txt'),
-              'w') as file:
-
-        if proceed == 'y':
-            # Generate the coordinates for the tiles:
-            xsteps = [xmin + float(xsize_tile) *
-                      i for i in range(round(tiles_x)+1)]
-            ysteps = [ymax - float(ysize_tile) *
-                      i for i in range(round(tiles_y)+1)]
-
-            print(f'\nX coordinates of tiles: {xsteps}')
-            print(f'Y coordinates of tiles: {ysteps}')
-
-            # Perform the segmentation and save the tiles:
-            for i in range(round(tiles_x)):
-                for j in range(round(tiles_y)):
-                    tile_xmin, tile_xmax = xsteps[i], xsteps[i + 1]
-                    tile_ymax, tile_ymin = ysteps[j], ysteps[j + 1]
+                if tile.array is None:
+                    print(f'Skipping {tile.name}: {tile.valid_fraction:.1%} valid pixels')
+                    if on_skip is not None:
+                        on_skip(tile.name, tile.valid_fraction)
+                    continue
+                yield tile
+    finally:
+        if tiles is not None:
+            tiles.close()  # cancels tiles still queued on the pool
+        if pool is not None:
+            pool.shutdown(wait=True)
+        # Explicitly close the GDAL dataset and drop the in-memory VRT:
+        raster = None
+        if gdal.VSIStatL(reprojected_path) is not None:
+            gdal.Unlink(reprojected_path)
+        if pin is not None:
+            pin.release()  # the cached raster may be evicted from now on
 
-                    # Writes each tile details to the text file:
-                    file.write(f'''\nFile Name: Segmented_{i}_{j}.tif
-    Tile xmin coordinates at top left: {tile_xmin}
-    Tile ymin coordinates at top left: {tile_ymax}
-    Size of the cut: {xsize_tile} x {ysize_tile} m\n''')
 
-                    print(f'\nTile {i},{j} bounds:')
-                    print(f'xmin: {tile_xmin}, xmax: {tile_xmax}')
-                    print(f'ymax: {tile_ymax}, ymin: {tile_ymin}')
-                    print('\n')
-
-                    tiff_tile_name = os.path.join(output_folder,
-                                                  f'Segmented_{i}_{j}.tif')
-                    jpg_tile_name = os.path.join(output_folder,
-                                                 f'Segmented_{i}_{j}.jpeg')
-
-                    # Use GDAL's Warp function to segment the raster based on
-                    # the tile coordinates:
-                    gdal.UseExceptions()
-                    try:
-                        gdal.Warp(tiff_tile_name, raster, outputBounds=(tile_xmin,
-                                                                        tile_ymin,
-                                                                        tile_xmax,
-                                                                        tile_ymax),
-                                  dstNodata=-9999)
-                        print(f"Successfully warped tile {i}, {j}")
-                    except Exception as e:
-                        print(f"Error warping tile {i}, {j}: {e}")
-
-                    # Open the TIFF tile, resize and save as JPEG
-                    with Image.open(tiff_tile_name) as tile_img:
-                        # Convert RGBA to RGB to remove alpha channel:
-                        if tile_img.mode == 'RGBA':
-                            tile_img = tile_img.convert('RGB')
-
-                        # Resize image to 1000x1000 pixels:
-                        tile_img.thumbnail((1000, 1000))
-
-                        # Set the Dots Per Inch (DPI) to 300:
-                        tile_img.save(jpg_tile_name, 'JPEG', quality=90,
-                                      dpi=(300, 300))
-
-                    print(f'\nTile saved as: {tiff_tile_name} and {jpg_tile_name}')
-
-            # After processing all tiles, deletes the 'reprojected.tif' file if
-            # it exists, to avoid conflicts when running this script multiple
-            # times:
-            reprojected_file_path = 'static/reprojected.tif'
-            if os.path.exists(reprojected_file_path):
-                try:
-                    # Explicitly close the GDAL dataset
-                    raster = None
-                    # Attempt to remove the file
-                    os.remove(reprojected_file_path)
-                    print(f"\nRemoved temporary file: {reprojected_file_path}")
-                except PermissionError as e:
-                    print(f"Could not remove temporary file due to: {e}")
-                else:
-                    print(f"No temporary file to remove: {reprojected_file_path}")
-
-        elif proceed == 'n':
-            print("Operation cancelled. No tiles generated.")
-        else:
-            print("Invalid input. No tiles generated.")
+# Open the TIFF file:
+# file_path = input('''Enter the file path to the '.tif' file, for example \
+# 'Path\\to\\file.tif': ''')
+# file_path = '210317 V 2D Bachelorarbeit SL Distr.V Abt. 1.tif'
+def tif_main(file_path, folder_path, workers=1):
+    """Split the raster into Segmented_{i}_{j}.tif/.jpeg tiles in folder_path."""
+    count = 0
+    for tile in iter_tiles(file_path, folder_path, save_jpeg=True, save_tiff=True, workers=workers):
+        count += 1
+        print(f'\nTile saved as: {tile.name}.tif and {tile.name}.jpeg')
+    print(f'\n{count} tiles written to {folder_path}')
@@ -0,0 +1,142 @@
+"""
+Batched YOLO inference.
+
+Images are decoded in a prefetch thread and pushed through a bounded queue,
+grouped into batches and run through one ``model.predict`` call per batch;
+per-image results are then handed back to the caller in input order.
+"""
+import queue
+import threading
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import cv2  # type: ignore
+except Exception:
+    cv2 = None
+
+_DONE = object()
+
+# (key, BGR ndarray or None when the image could not be decoded)
+Item = Tuple[Any, Any]
+
+
+def decode_images(paths: Iterable[str]) -> Iterator[Item]:
+    """Yield (path, BGR array) for each path; undecodable files yield (path, None)."""
+    for p in paths:
+        img = None
+        if cv2 is not None:
+            try:
+                img = cv2.imread(p, cv2.IMREAD_COLOR)
+            except Exception:
+                img = None
+        yield p, img
+
+
+def _prefetch(items: Iterable[Item], depth: int) -> Iterator[Item]:
+    """Run the ``items`` iterator in a background thread, buffering up to ``depth`` items."""
+    q: "queue.Queue" = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+
+    def worker():
+        try:
+            for it in items:
+                if stop.is_set():
+                    return
+                q.put(it)
+        except Exception as e:  # surfaced to the consumer below
+            q.put(e)
+        finally:
+            q.put(_DONE)
+
+    t = threading.Thread(target=worker, name="yolo-prefetch", daemon=True)
+    t.start()
+    try:
+        while True:
+            it = q.get()
+            if it is _DONE:
+                break
+            if isinstance(it, Exception):
+                raise it
+            yield it
+    finally:
+        stop.set()
+        # unblock the producer if it is waiting on a full queue
+        while t.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                t.join(0.05)
+
+
+def _batches(items: Iterable[Item], batch_size: int) -> Iterator[List[Item]]:
+    batch: List[Item] = []
+    for it in items:
+        batch.append(it)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _label(key) -> str:
+    """Printable name of an item key (a path, or a record with ``rel``)."""
+    return str(getattr(key, "rel", key))
+
+
+def predict_batched(model, items: Iterable[Item], batch_size: int = 8, prefetch: int = 2,
+                    imgsz: int = 1024, conf: float = 0.25, iou: float = 0.45,
+                    device: str = "cpu", cache=None) -> Iterator[Tuple[Any, Any, Optional[Any]]]:
+    """
+    Yield (key, image, result) for every input item, in input order.
+
+    ``items`` yields (key, BGR array) pairs and is consumed in a prefetch
+    thread, so decoding (or tiling) overlaps with the forward pass. Every
+    image is letterboxed to ``imgsz`` so a batch always shares one input
+    shape. ``result`` is None when the image could not be decoded or its
+    inference failed; when a batch fails its images are retried one at a
+    time, so only the image that actually breaks ``predict`` is lost.
+
+    ``cache`` (a BoundDetectionCache for the same weights and parameters)
+    is consulted before inference; only misses reach ``model.predict`` and
+    their results are stored back.
+    """
+    batch_size = max(1, int(batch_size))
+    stream = _prefetch(items, depth=batch_size * max(1, int(prefetch)))
+    for batch in _batches(stream, batch_size):
+        results = {}
+        valid = []
+        keys = {}  # id(img) -> cache key, hashed once per image
+        for k, img in batch:
+            if img is None:
+                continue
+            hit = None
+            if cache is not None:
+                keys[id(img)] = cache.key(img)
+                hit = cache.lookup(img, _label(k), keys[id(img)])
+            if hit is not None:
+                results[id(img)] = hit
+            else:
+                valid.append((k, img))
+        if valid:
+            def predict(source):
+                return model.predict(source=source, conf=conf, iou=iou,
+                                     imgsz=imgsz, device=device, verbose=False)
+
+            try:
+                preds = list(zip(valid, predict([img for _, img in valid])))
+            except Exception as e:
+                # one bad image must not cost the whole batch: retry them one by one
+                print(f"Batch of {len(valid)} failed ({type(e).__name__}: {e}); retrying per image")
+                preds = []
+                for k, img in valid:
+                    try:
+                        preds.append(((k, img), predict([img])[0]))
+                    except Exception as e:
+                        print(f"Inference failed for {_label(k)}: {type(e).__name__}: {e}")
+            for (_, img), r in preds:
+                results[id(img)] = r
+                if cache is not None:
+                    cache.store(img, r, keys[id(img)])
+        for k, img in batch:
+            yield k, img, results.get(id(img)) if img is not None else None
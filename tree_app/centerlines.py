@@ -0,0 +1,124 @@
+"""
+Merged path centerlines for a run's GeoJSON (port of the old process_geojson).
+
+Every ``path`` LineString is buffered by ``tolerance``; the buffers are split
+into connected components with an STRtree intersects query plus union-find,
+and each component is unioned, simplified and run through
+``pygeoops.centerline`` in a process pool. Components never touch, so the
+stitched result matches one global ``unary_union`` (polygons are normalised
+first, so the output does not depend on how the work was split). Tree
+points are copied through unchanged.
+
+The input is read with ``georef.iter_features`` and the output written with
+a ``GeoJSONWriter``, so only the path geometries are held in memory; tree
+features stream from one file to the other.
+"""
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import shapely  # type: ignore
+    from shapely.geometry import LineString, MultiLineString, MultiPolygon, Polygon, shape, mapping  # type: ignore
+    from shapely.ops import unary_union  # type: ignore
+    from shapely.strtree import STRtree  # type: ignore
+    import pygeoops  # type: ignore
+    from helpers import connected_components  # type: ignore  # project-root union-find
+except Exception:
+    shapely = pygeoops = None
+
+from . import georef
+
+OTHER_CATEGORIES = ("unhealthy-tree", "fallen-tree", "single-tree")
+
+# below this many components the pool start-up costs more than it saves
+_MIN_PARALLEL_COMPONENTS = 4
+
+# timings: seconds per stage; components / centerlines: how many of each
+CenterlineStats = namedtuple("CenterlineStats", ["timings", "components", "centerlines"])
+
+
+def available() -> bool:
+    return shapely is not None and pygeoops is not None
+
+
+def _components(geoms) -> List[List[int]]:
+    """Indices of geoms grouped into connected (intersecting) components."""
+    left, right = STRtree(geoms).query(geoms, predicate="intersects")
+    return connected_components(len(geoms), zip(left.tolist(), right.tolist()))
+
+
+def _component_centerlines(wkbs: List[bytes]) -> List[bytes]:
+    """Union one component's buffers and return its centerlines (as WKB)."""
+    merged = unary_union(shapely.from_wkb(wkbs))
+    if not merged.is_valid:
+        merged = merged.buffer(0)
+        if not merged.is_valid:
+            return []
+    if not isinstance(merged, (Polygon, MultiPolygon)):
+        return []
+    out = []
+    for poly in ([merged] if isinstance(merged, Polygon) else merged.geoms):
+        # normalised rings make simplify (and so the centerline) independent of
+        # where the union happened to start each ring
+        poly = shapely.normalize(poly)
+        centerline = pygeoops.centerline(poly.simplify(tolerance=1.0, preserve_topology=True))
+        if centerline.is_empty:
+            continue
+        if isinstance(centerline, LineString):
+            out.append(centerline.wkb)
+        elif isinstance(centerline, MultiLineString):
+            out.extend(line.wkb for line in centerline.geoms)
+    return out
+
+
+def process_geojson(geojson_path: str, tolerance: float, out_path: str,
+                    workers: Optional[int] = None) -> CenterlineStats:
+    """
+    Write ``out_path``: the tree features of ``geojson_path`` plus the merged
+    path centerlines. Returns the seconds spent per stage and the number of
+    components and centerlines.
+    """
+    timings: Dict[str, float] = {}
+    t = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal t
+        now = time.perf_counter()
+        timings[stage] = round(now - t, 3)
+        t = now
+
+    paths = np.array([shape(ft["geometry"]) for ft in georef.iter_features(geojson_path)
+                      if ft.get("properties", {}).get("name") == "path" and ft.get("geometry")], dtype=object)
+    lap("load")
+
+    buffers = shapely.buffer(paths, tolerance) if len(paths) else paths
+    lap("buffer")
+
+    groups = [[buffers[i].wkb for i in idx] for idx in _components(buffers)] if len(buffers) else []
+    lap("components")
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(groups) >= _MIN_PARALLEL_COMPONENTS:
+        with ProcessPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+            parts = list(pool.map(_component_centerlines, groups, chunksize=max(1, len(groups) // (4 * workers))))
+    else:
+        parts = [_component_centerlines(g) for g in groups]
+    centerlines = [shapely.from_wkb(w) for part in parts for w in part]
+    lap("centerline")
+
+    with georef.GeoJSONWriter(os.path.abspath(out_path)) as out:
+        # second pass over the input: tree features are copied, never collected
+        out.write_features(ft for ft in georef.iter_features(geojson_path)
+                           if ft.get("properties", {}).get("name") in OTHER_CATEGORIES)
+        out.write_features({"type": "Feature", "properties": {"name": "path"}, "geometry": mapping(line)}
+                           for line in centerlines)
+    lap("write")
+
+    stats = CenterlineStats(timings, len(groups), len(centerlines))
+    print(f"Centerlines: {stats}")
+    return stats
@@ -0,0 +1,205 @@
+"""
+Resumable, chunked uploads into static/input_img/<run_id>.
+
+``init`` preallocates the target file and writes a small manifest; every
+chunk is written at its offset through its own file handle (so chunks can
+arrive in parallel and in any order) and recorded as a range marker file
+once it is complete. ``missing`` tells a client what to (re-)send after a
+dropped connection, and ``finalize`` checks coverage and the SHA-256 before
+the run is queued. ``finalize`` first claims the session by renaming its
+manifest, so of two concurrent finalize calls only one gets through.
+Sessions that see no chunk for a while are removed by ``sweep_expired``.
+"""
+import json
+import os
+import re
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .reprojection_cache import file_sha256
+
+ALLOWED_EXTENSIONS = (".zip", ".tif", ".tiff")
+_STATE_DIR = ".upload"
+_RUN_ID_RE = re.compile(r"[0-9A-Za-z_-]+")
+_READ_SIZE = 1 << 20
+
+
+class UploadError(Exception):
+    """Client error; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def valid_run_id(run_id: str) -> bool:
+    return bool(_RUN_ID_RE.fullmatch(run_id or ""))
+
+
+def _state_dir(run_input_dir: str) -> str:
+    return os.path.join(run_input_dir, _STATE_DIR)
+
+
+def load_manifest(run_input_dir: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(_state_dir(run_input_dir), "manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def init(run_input_dir: str, filename: str, size: int, sha256: str = "", options: Optional[Dict] = None) -> Dict:
+    """Create the upload session: preallocated file plus manifest."""
+    filename = os.path.basename(filename or "")
+    if not filename or filename.startswith(".") or not filename.lower().endswith(ALLOWED_EXTENSIONS):
+        raise UploadError(f"filename must end with one of {', '.join(ALLOWED_EXTENSIONS)}")
+    if size <= 0:
+        raise UploadError("size must be positive")
+
+    state = _state_dir(run_input_dir)
+    os.makedirs(os.path.join(state, "ranges"), exist_ok=True)
+    with open(os.path.join(run_input_dir, filename), "wb") as f:
+        f.truncate(size)
+    manifest = {"filename": filename, "size": size, "sha256": sha256.lower(), "options": options or {},
+                "touched_at": time.time()}
+    with open(os.path.join(state, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def write_chunk(run_input_dir: str, manifest: Dict, offset: int, length: int, stream) -> int:
+    """
+    Copy ``length`` bytes from ``stream`` (``.read(n)``) into the file at
+    ``offset``. The range is recorded only when it arrived completely.
+    Returns the number of bytes written.
+    """
+    if offset < 0 or length <= 0 or offset + length > manifest["size"]:
+        raise UploadError(f"chunk {offset}+{length} outside 0..{manifest['size']}", status=416)
+
+    written = 0
+    with open(os.path.join(run_input_dir, manifest["filename"]), "r+b") as f:
+        f.seek(offset)
+        while written < length:
+            buf = stream.read(min(_READ_SIZE, length - written))
+            if not buf:
+                break
+            f.write(buf)
+            written += len(buf)
+    if written != length:
+        raise UploadError(f"chunk at {offset} incomplete: {written} of {length} bytes")
+
+    marker = os.path.join(_state_dir(run_input_dir), "ranges", f"{offset:020d}-{offset + length:020d}")
+    open(marker, "w").close()
+    return written
+
+
+def last_touched(run_input_dir: str, manifest: Dict) -> float:
+    """
+    When the session last saw activity. Chunks do not rewrite the manifest
+    (that would race with the rename in ``finalize``); creating their range
+    marker bumps the mtime of ranges/ instead.
+    """
+    times = [manifest.get("touched_at", 0.0)]
+    state = _state_dir(run_input_dir)
+    for p in (os.path.join(state, "manifest.json"), os.path.join(state, "ranges")):
+        try:
+            times.append(os.stat(p).st_mtime)
+        except OSError:
+            pass
+    return max(times)
+
+
+def sweep_expired(input_root: str, ttl_seconds: float) -> List[str]:
+    """Delete open sessions idle for longer than ``ttl_seconds``; returns their run ids."""
+    if ttl_seconds <= 0 or not os.path.isdir(input_root):
+        return []
+    cutoff = time.time() - ttl_seconds
+    swept = []
+    for run_id in os.listdir(input_root):
+        run_input_dir = os.path.join(input_root, run_id)
+        manifest = load_manifest(run_input_dir)  # None: not an open session (or being finalized)
+        if manifest is None or last_touched(run_input_dir, manifest) > cutoff:
+            continue
+        shutil.rmtree(run_input_dir, ignore_errors=True)
+        swept.append(run_id)
+    return swept
+
+
+def received(run_input_dir: str) -> List[Tuple[int, int]]:
+    """Completed byte ranges [start, end), merged and sorted."""
+    ranges = []
+    try:
+        names = os.listdir(os.path.join(_state_dir(run_input_dir), "ranges"))
+    except OSError:
+        return []
+    for name in names:
+        try:
+            start, end = (int(v) for v in name.split("-"))
+        except ValueError:
+            continue
+        ranges.append((start, end))
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing(ranges: List[Tuple[int, int]], size: int) -> List[Tuple[int, int]]:
+    gaps, pos = [], 0
+    for start, end in ranges:
+        if start > pos:
+            gaps.append((pos, start))
+        pos = max(pos, end)
+    if pos < size:
+        gaps.append((pos, size))
+    return gaps
+
+
+def status(run_input_dir: str, manifest: Dict) -> Dict:
+    ranges = received(run_input_dir)
+    return {
+        "filename": manifest["filename"],
+        "size": manifest["size"],
+        "received_bytes": sum(end - start for start, end in ranges),
+        "received": ranges,
+        "missing": missing(ranges, manifest["size"]),
+        "touched_at": last_touched(run_input_dir, manifest),
+    }
+
+
+def finalize(run_input_dir: str, manifest: Dict, sha256: str = "") -> str:
+    """
+    Claim the session, check that every byte arrived and the checksum
+    matches, then drop the session state. Returns the file's SHA-256. On a
+    failed check the session is reopened so the client can fix it and retry.
+    """
+    state = _state_dir(run_input_dir)
+    open_path = os.path.join(state, "manifest.json")
+    claimed_path = os.path.join(state, "finalizing.json")
+    try:
+        os.rename(open_path, claimed_path)  # atomic: only one caller wins
+    except FileNotFoundError:
+        raise UploadError("upload is already being finalized", status=409)
+
+    try:
+        gaps = missing(received(run_input_dir), manifest["size"])
+        if gaps:
+            raise UploadError(f"missing byte ranges: {gaps}", status=409)
+        expected = (sha256 or manifest.get("sha256") or "").lower()
+        if not expected:
+            raise UploadError("sha256 is required")
+        actual = file_sha256(os.path.join(run_input_dir, manifest["filename"]))
+        if actual != expected:
+            # the bytes on disk cannot be trusted: make the client send everything again
+            shutil.rmtree(os.path.join(state, "ranges"), ignore_errors=True)
+            os.makedirs(os.path.join(state, "ranges"), exist_ok=True)
+            raise UploadError(f"sha256 mismatch: got {actual}", status=422)
+    except BaseException:
+        os.rename(claimed_path, open_path)
+        raise
+    shutil.rmtree(state, ignore_errors=True)
+    return actual
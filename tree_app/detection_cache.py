@@ -0,0 +1,160 @@
+"""
+Persistent cache of raw YOLO detections per tile.
+
+Key: SHA-1 of the decoded pixels + weights digest + inference parameters
+(conf, iou, imgsz). Value: boxes (xyxy, conf, cls), mask polygons and class
+names, zlib-compressed JSON in a small SQLite file. A hit is rebuilt into an
+ultralytics ``Results`` so annotation and GeoJSON code run unchanged.
+Bounded by ``max_bytes``; least-recently-used rows are evicted first.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except Exception:
+    cv2 = None
+
+try:
+    import torch  # type: ignore
+    from ultralytics.engine.results import Results  # type: ignore
+except Exception:
+    torch = Results = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detections_last_used ON detections(last_used);
+"""
+
+
+def image_digest(img: np.ndarray) -> str:
+    h = hashlib.sha1(str(img.shape).encode("ascii"))
+    h.update(np.ascontiguousarray(img).data)
+    return h.hexdigest()
+
+
+def _encode(r) -> bytes:
+    boxes = r.boxes.data.cpu().numpy() if r.boxes is not None else np.zeros((0, 6))
+    polygons = [np.asarray(p).tolist() for p in r.masks.xy] if r.masks is not None else []
+    return zlib.compress(json.dumps({
+        "orig_shape": list(r.orig_shape),
+        "names": {str(k): v for k, v in r.names.items()},
+        "boxes": boxes.tolist(),
+        "polygons": polygons,
+    }).encode("utf-8"))
+
+
+def _decode(blob: bytes, img: np.ndarray, path: str):
+    data = json.loads(zlib.decompress(blob).decode("utf-8"))
+    h, w = data["orig_shape"]
+    names = {int(k): v for k, v in data["names"].items()}
+    boxes = torch.tensor(data["boxes"], dtype=torch.float32).reshape(-1, 6)
+    masks = None
+    if data["polygons"]:
+        # rasterise the stored polygons back to full-resolution masks
+        m = np.zeros((len(data["polygons"]), h, w), dtype=np.uint8)
+        for i, poly in enumerate(data["polygons"]):
+            if len(poly) >= 3:
+                cv2.fillPoly(m[i], [np.round(np.asarray(poly)).astype(np.int32)], 1)
+        masks = torch.from_numpy(m)
+    return Results(orig_img=img, path=path, names=names, boxes=boxes, masks=masks)
+
+
+class DetectionCache:
+    def __init__(self, db_path: str, max_bytes: int):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and Results is not None and cv2 is not None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def bind(self, model_digest: str, conf: float, iou: float, imgsz: int) -> "BoundDetectionCache":
+        return BoundDetectionCache(self, f"{model_digest}|conf={conf}|iou={iou}|imgsz={imgsz}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        conn = self._conn()
+        row = conn.execute("SELECT value FROM detections WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE detections SET last_used = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        return row[0]
+
+    def put(self, key: str, value: bytes) -> None:
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO detections(key, value, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time()),
+        )
+        conn.commit()
+        self._writes += 1
+        if self._writes % 50 == 1:
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop least-recently-used rows until the cache is under 90% of max_bytes."""
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM detections").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM detections ORDER BY last_used"):
+            if total <= target:
+                break
+            doomed.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM detections WHERE key = ?", doomed)
+        conn.commit()
+
+
+class BoundDetectionCache:
+    """DetectionCache scoped to one set of weights and inference parameters."""
+
+    def __init__(self, cache: DetectionCache, scope: str):
+        self.cache = cache
+        self.scope = scope
+
+    def key(self, img: np.ndarray) -> str:
+        """Cache key of img; hashes the full frame, so compute it once per image."""
+        return hashlib.sha1(f"{image_digest(img)}|{self.scope}".encode("utf-8")).hexdigest()
+
+    def lookup(self, img: np.ndarray, path: str = "", key: Optional[str] = None):
+        """Return a rebuilt Results for img, or None on a miss."""
+        try:
+            blob = self.cache.get(key or self.key(img))
+            return _decode(blob, img, path) if blob is not None else None
+        except Exception:
+            return None
+
+    def store(self, img: np.ndarray, result, key: Optional[str] = None) -> None:
+        try:
+            self.cache.put(key or self.key(img), _encode(result))
+        except Exception:
+            pass
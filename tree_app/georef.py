@@ -0,0 +1,221 @@
+"""
+In-memory georeferencing of detections.
+
+Each annotated image becomes a ``TileDetections`` (its detections in pixel
+space plus the tile's GDAL geotransform) that goes straight from inference
+to the GeoJSON FeatureCollection, replacing the per-image JSON files the old
+flow wrote to static/centers and static/location and read back.
+"""
+import json
+import os
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import inference  # type: ignore  # project-root annotation helpers (center_points)
+except Exception:
+    inference = None
+
+# points: [(class name, (x, y) pixel, area text)]
+# paths:  [(area text, (M, 2) pixel polyline)]
+TileDetections = namedtuple("TileDetections", ["name", "geotransform", "points", "paths"])
+
+_CRS_NAME = "urn:ogc:def:crs:EPSG::3857"
+
+
+def parse_world_file(text: str) -> Optional[Tuple[float, ...]]:
+    """
+    Parse .jgw/.tfw world file contents as a GDAL geotransform. World files
+    refer to the centre of the upper-left pixel; the geotransform to its corner.
+    """
+    try:
+        a, d, b, e, c, f = (float(v) for v in text.split()[:6])
+    except ValueError:
+        return None
+    return (c - a / 2 - b / 2, a, b, f - d / 2 - e / 2, d, e)
+
+
+def read_world_file(path: str) -> Optional[Tuple[float, ...]]:
+    try:
+        with open(path, "r") as f:
+            return parse_world_file(f.read())
+    except OSError:
+        return None
+
+
+def as_geotransform(transform) -> Tuple[float, ...]:
+    """GDAL geotransform from a GDAL tuple or a rasterio/affine ``Affine``."""
+    if hasattr(transform, "to_gdal"):
+        return tuple(transform.to_gdal())
+    return tuple(float(v) for v in transform)
+
+
+def pixel_to_world(gt, xy) -> np.ndarray:
+    """
+    Map an (N, 2) array of pixel (x, y) to world coordinates with the full
+    affine (rotation/shear terms included) in one matrix product.
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    m = np.array([[gt[1], gt[4]], [gt[2], gt[5]]])
+    return xy @ m + (gt[0], gt[3])
+
+
+def tile_detections(name: str, result, postion_ls: List[Dict], geotransform) -> TileDetections:
+    """
+    Collect one image's detections from its YOLO result and the ``postion_ls``
+    returned by ``inference.annotate_result``. Points come from
+    ``inference.center_points`` (mask-vertex mean, box centre without masks,
+    excluded classes dropped); paths are the smoothed centerline polylines.
+    """
+    points = []
+    boxes = result.boxes
+    if boxes is not None and len(boxes):
+        names = [result.names.get(c, f"Class {c}") for c in boxes.cls.int().tolist()]
+        # annotate_result lists the area of every non-path detection in order
+        areas = iter([next(iter(p.values())) for p in postion_ls if "path" not in p])
+        area_of = {i: next(areas, "") for i, name in enumerate(names) if "path" not in name}
+        centers, index = inference.center_points(boxes, result.masks, return_index=True)
+        for (cx, cy), i in zip(centers.tolist(), index.tolist()):
+            if i in area_of:
+                points.append((names[i], (cx, cy), area_of[i]))
+
+    paths = []
+    for p in postion_ls:
+        lines = p.get("line_value", False)
+        if "path" in p and lines is not False and len(lines):
+            lines = np.asarray(lines, dtype=np.float64)
+            # (M, 2, 2) start/end pairs -> (M + 1, 2) polyline
+            paths.append((p["path"], np.vstack((lines[:, 0], lines[-1:, 1]))))
+
+    return TileDetections(name, as_geotransform(geotransform), points, paths)
+
+
+def _feature(fid: int, geometry: Dict, name: str, description: str, area: str) -> Dict:
+    return {
+        "type": "Feature",
+        "geometry": geometry,
+        "properties": {
+            "id": fid,
+            "name": name,
+            "description": description,
+            "polygon_area": f"{area}",
+        },
+    }
+
+
+def tile_features(tile: TileDetections, model_selection: str, first_id: int = 1) -> List[Dict]:
+    """GeoJSON features of one tile: paths only for winter, points and paths otherwise."""
+    points = tile.points if model_selection != "winter" else []
+    # every point and path vertex of the tile goes through one transform
+    parts = [np.array([xy for _, xy, _ in points], dtype=np.float64).reshape(-1, 2)]
+    parts += [line for _, line in tile.paths]
+    world = pixel_to_world(tile.geotransform, np.concatenate(parts)).tolist()
+
+    features = []
+    fid = first_id
+    for class_name, _, area in points:
+        geometry = {"type": "Point", "coordinates": world[fid - first_id]}
+        features.append(_feature(fid, geometry, class_name, tile.name, area))
+        fid += 1
+    start = len(points)
+    for area, line in tile.paths:
+        coords = world[start:start + len(line)]
+        start += len(line)
+        features.append(_feature(fid, {"type": "LineString", "coordinates": coords}, "path", tile.name, area))
+        fid += 1
+    return features
+
+
+def _header() -> Dict:
+    return {
+        "type": "FeatureCollection",
+        "name": "single-tree",
+        "crs": {"type": "name", "properties": {"name": _CRS_NAME}},
+    }
+
+
+def feature_collection(tiles: Iterable[TileDetections], model_selection: str) -> Dict:
+    features = []
+    for tile in tiles:
+        features.extend(tile_features(tile, model_selection, first_id=len(features) + 1))
+    return {**_header(), "features": features}
+
+
+class GeoJSONWriter:
+    """
+    Incremental FeatureCollection writer: the header goes out on open,
+    features are appended (and flushed) as tiles are processed, and the
+    array is closed by ``close``, so memory does not grow with the number
+    of detections and the file fills in while the run is going.
+
+    With ``seq_path`` every feature is also written to a newline-delimited
+    GeoJSON (GeoJSONSeq) file that consumers can read progressively.
+    """
+
+    def __init__(self, path: str, model_selection: str = "", seq_path: Optional[str] = None):
+        self.path = path
+        self.seq_path = seq_path
+        self.model_selection = model_selection
+        self.count = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._f = open(path, "w", encoding="utf-8")
+        head = json.dumps(_header())
+        self._f.write(head[:-1] + ', "features": [\n')
+        self._seq = open(seq_path, "w", encoding="utf-8") if seq_path else None
+
+    def write_features(self, features: Iterable[Dict]) -> None:
+        for feature in features:
+            text = json.dumps(feature)
+            self._f.write((",\n" if self.count else "") + text)
+            if self._seq is not None:
+                self._seq.write(text + "\n")
+            self.count += 1
+        self._f.flush()
+        if self._seq is not None:
+            self._seq.flush()
+
+    def write_tile(self, tile: TileDetections) -> None:
+        self.write_features(tile_features(tile, self.model_selection, first_id=self.count + 1))
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        self._f.write("\n]}\n")
+        self._f.close()
+        if self._seq is not None:
+            self._seq.close()
+
+    def __enter__(self) -> "GeoJSONWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def iter_features(path: str) -> Iterator[Dict]:
+    """
+    Features of a FeatureCollection file, one at a time. Files written by
+    GeoJSONWriter (one feature per line) are streamed without loading the
+    whole collection; any other file is parsed in one go.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if f.readline().rstrip().endswith('"features": ['):
+            for line in f:
+                line = line.strip().rstrip(",")
+                if line and line != "]}":
+                    yield json.loads(line)
+            return
+        f.seek(0)
+        data = json.load(f)
+    yield from data.get("features", [])
+
+
+def write_geojson(path: str, tiles: Iterable[TileDetections], model_selection: str,
+                  seq_path: Optional[str] = None) -> int:
+    """Stream the tiles' features to path (and seq_path). Returns the feature count."""
+    with GeoJSONWriter(path, model_selection, seq_path) as writer:
+        for tile in tiles:
+            writer.write_tile(tile)
+    return writer.count
@@ -0,0 +1,245 @@
+"""
+SQLite-backed job queue for the /index pipeline.
+
+Each job is an OutputRun row. The view saves the uploads and calls
+``enqueue``; worker processes started with ``manage.py run_workers`` claim
+queued rows with a conditional UPDATE (safe across processes on SQLite) and
+run ``pipeline.run_pipeline``, recording progress and final artifact paths.
+
+A claimed job records its owner ("host:pid") and keeps a heartbeat while it
+runs; ``requeue_stale`` only hands back jobs whose owner is gone (process
+dead, or no heartbeat for JOB_LEASE_SECONDS), never ones another worker
+pool or a sync request is still processing. Idle workers run it
+periodically, and the pool parent restarts workers that exit.
+"""
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from .models import OutputRun
+
+
+def lease_seconds() -> float:
+    return float(getattr(settings, "JOB_LEASE_SECONDS", 120))
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: str) -> bool:
+    """False only when owner is a process on this host that no longer exists."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True  # cannot tell from here; the heartbeat decides
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by another user
+    return True
+
+
+def enqueue(run_id: str, model_selection: str, model_name: str, label: str = "",
+            input_dir: str = "", result_dir: str = "", options: Optional[Dict] = None,
+            running: bool = False) -> OutputRun:
+    """
+    Create the job row. With ``running`` it is created already claimed by
+    this process (sync requests), so no worker can pick it up first.
+    """
+    now = timezone.now()
+    return OutputRun.objects.create(
+        run_id=run_id,
+        status=OutputRun.RUNNING if running else OutputRun.QUEUED,
+        started_at=now if running else None,
+        owner=_owner() if running else "",
+        heartbeat_at=now if running else None,
+        label=label,
+        model=model_selection,
+        model_name=model_name,
+        input_dir=input_dir,
+        result_dir=result_dir,
+        meta={"options": options or {}},
+    )
+
+
+def claim_next() -> Optional[OutputRun]:
+    """Atomically move the oldest queued job to RUNNING, owned by this process, and return it."""
+    for pk in OutputRun.objects.filter(status=OutputRun.QUEUED).order_by("created_at").values_list("pk", flat=True)[:10]:
+        now = timezone.now()
+        claimed = OutputRun.objects.filter(pk=pk, status=OutputRun.QUEUED).update(
+            status=OutputRun.RUNNING, started_at=now, error="", owner=_owner(), heartbeat_at=now,
+        )
+        if claimed:
+            return OutputRun.objects.get(pk=pk)
+    return None
+
+
+class _Heartbeat:
+    """Refresh a running job's heartbeat_at from a background thread until stopped."""
+
+    def __init__(self, pk, interval: float):
+        self.pk = pk
+        self.interval = max(1.0, interval)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-heartbeat-{pk}", daemon=True)
+
+    def _run(self) -> None:
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    OutputRun.objects.filter(pk=self.pk, status=OutputRun.RUNNING).update(heartbeat_at=timezone.now())
+                except Exception as e:
+                    # e.g. "database is locked" while other workers write progress:
+                    # the next tick retries, well within the lease
+                    print(f"Heartbeat for job {self.pk} failed: {type(e).__name__}: {e}")
+        finally:
+            connections.close_all()  # this thread's connection only
+
+    def __enter__(self) -> "_Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_job(job: OutputRun) -> Dict:
+    """Execute one claimed job and persist its outcome. Returns the pipeline payload."""
+    from .pipeline import run_pipeline
+
+    def progress(done: int, total: int) -> None:
+        OutputRun.objects.filter(pk=job.pk).update(progress_done=done, progress_total=total,
+                                                   heartbeat_at=timezone.now())
+
+    try:
+        with _Heartbeat(job.pk, lease_seconds() / 4):
+            payload = run_pipeline(job.run_id, job.model, job.model_name, progress=progress,
+                                   **(job.meta or {}).get("options", {}))
+    except Exception as e:
+        traceback.print_exc()
+        OutputRun.objects.filter(pk=job.pk).update(
+            status=OutputRun.FAILED, error=f"{type(e).__name__}: {e}", finished_at=timezone.now(),
+        )
+        raise
+
+    outs = payload.get("output_image_list", [])
+    meta = dict(job.meta or {})
+    meta.update(payload.get("meta", {}))
+    OutputRun.objects.filter(pk=job.pk).update(
+        status=OutputRun.DONE,
+        finished_at=timezone.now(),
+        zip_path=payload.get("zip_path", ""),
+        geojson_path=payload.get("geojson_path", ""),
+        input_images=payload.get("input_image_list", []),
+        output_images=outs,
+        thumbnail=outs[0] if outs else "",
+        meta=meta,
+    )
+    return payload
+
+
+def job_payload(job: OutputRun) -> Dict:
+    """Status / progress / artifacts for the job-status API."""
+    return {
+        "run_id": job.run_id,
+        "job_status": job.status,
+        "progress": {"done": job.progress_done, "total": job.progress_total},
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else "",
+        "started_at": job.started_at.isoformat() if job.started_at else "",
+        "finished_at": job.finished_at.isoformat() if job.finished_at else "",
+        "zip_path": job.zip_path,
+        "geojson_path": job.geojson_path,
+        "input_image_list": job.input_images,
+        "output_image_list": job.output_images,
+        "meta": job.meta,
+    }
+
+
+# ---------------- workers ----------------
+def requeue_stale() -> int:
+    """
+    Put jobs left RUNNING by a crashed worker back in the queue: their owner
+    process is gone, or they have not sent a heartbeat for a full lease.
+    Jobs still owned by a live worker or web process are left alone.
+    """
+    cutoff = timezone.now() - timedelta(seconds=lease_seconds())
+    requeued = 0
+    for pk, owner, heartbeat_at in OutputRun.objects.filter(status=OutputRun.RUNNING).values_list(
+            "pk", "owner", "heartbeat_at"):
+        expired = heartbeat_at is None or heartbeat_at < cutoff
+        if not expired and _owner_alive(owner):
+            continue
+        # only if nobody re-claimed or refreshed it in the meantime
+        requeued += OutputRun.objects.filter(pk=pk, status=OutputRun.RUNNING, owner=owner,
+                                             heartbeat_at=heartbeat_at).update(
+            status=OutputRun.QUEUED, started_at=None, owner="", heartbeat_at=None)
+    return requeued
+
+
+def work(poll_interval: float = 1.0, once: bool = False) -> None:
+    """
+    Worker loop: claim and run jobs until interrupted (or the queue is empty
+    with ``once``). While idle it requeues stale jobs every half lease, so
+    the job of a crashed (e.g. OOM-killed) sibling is picked up again without
+    restarting the pool.
+    """
+    last_reap = 0.0
+    while True:
+        close_old_connections()
+        job = claim_next()
+        if job is None:
+            if once:
+                return
+            if time.monotonic() - last_reap >= lease_seconds() / 2:
+                last_reap = time.monotonic()
+                try:
+                    requeue_stale()
+                except Exception as e:
+                    print(f"Requeueing stale jobs failed: {type(e).__name__}: {e}")
+            time.sleep(poll_interval)
+            continue
+        try:
+            run_job(job)
+        except Exception:
+            pass  # already recorded on the job row
+
+
+def _spawn(n: int, poll_interval: float):
+    # never share the parent's SQLite connection with forked children
+    connections.close_all()
+    p = multiprocessing.get_context("fork").Process(
+        target=work, kwargs={"poll_interval": poll_interval}, name=f"tree-worker-{n}", daemon=False)
+    p.start()
+    return p
+
+
+def start_pool(workers: int, poll_interval: float = 1.0):
+    """Fork ``workers`` processes running ``work``. Returns the Process list."""
+    requeue_stale()
+    return [_spawn(n, poll_interval) for n in range(max(1, workers))]
+
+
+def respawn_dead(procs, poll_interval: float = 1.0) -> int:
+    """Replace (in place) pool processes that have exited. Returns how many were restarted."""
+    restarted = 0
+    for n, p in enumerate(procs):
+        if p.is_alive():
+            continue
+        p.join()
+        print(f"Worker {p.name} (pid {p.pid}) exited with code {p.exitcode}; restarting it")
+        procs[n] = _spawn(n, poll_interval)
+        restarted += 1
+    return restarted
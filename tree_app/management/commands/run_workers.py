@@ -0,0 +1,44 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tree_app import jobs
+
+
+class Command(BaseCommand):
+    help = "Run the pool of worker processes that execute queued /index jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=getattr(settings, "JOB_WORKERS", 2))
+        parser.add_argument("--poll", type=float, default=1.0, help="seconds between queue polls")
+        parser.add_argument("--once", action="store_true", help="drain the queue in-process and exit")
+
+    def handle(self, *args, **opts):
+        if opts["once"]:
+            jobs.requeue_stale()
+            jobs.work(poll_interval=opts["poll"], once=True)
+            return
+
+        procs = jobs.start_pool(opts["workers"], poll_interval=opts["poll"])
+        self.stdout.write(f"Started {len(procs)} worker(s): {[p.pid for p in procs]}")
+        stopping = False
+
+        def _stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for p in procs:
+                p.terminate()
+
+        signal.signal(signal.SIGTERM, _stop)
+        try:
+            # keep the pool at full size: a worker that dies (e.g. OOM-killed) is replaced
+            while not stopping:
+                time.sleep(max(1.0, opts["poll"]))
+                if not stopping:
+                    jobs.respawn_dead(procs, poll_interval=opts["poll"])
+        except KeyboardInterrupt:
+            _stop(None, None)
+        for p in procs:
+            p.join()
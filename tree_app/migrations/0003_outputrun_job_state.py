@@ -0,0 +1,48 @@
+# Generated by Django 4.2.14 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tree_app', '0002_outputrun_delete_customuser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outputrun',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='done', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='outputrun',
+            name='progress_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='outputrun',
+            name='progress_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='outputrun',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='outputrun',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outputrun',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outputrun',
+            name='meta',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
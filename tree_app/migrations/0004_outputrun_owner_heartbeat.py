@@ -0,0 +1,23 @@
+# Generated by Django 4.2.14 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tree_app', '0003_outputrun_job_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outputrun',
+            name='owner',
+            field=models.CharField(blank=True, max_length=128),
+        ),
+        migrations.AddField(
+            model_name='outputrun',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,226 @@
+"""
+Process-wide registry of loaded YOLO models.
+
+Loading a .pt file (weight deserialization + graph build) is expensive, so
+models are kept resident and reused across requests.  Entries are keyed by
+(season folder, file name, mtime, size) so an overwritten weight file is
+never served stale, and are evicted LRU once the estimated memory of all
+resident models exceeds ``YOLO_MODEL_CACHE_MB``.
+
+Ultralytics predictors keep per-call state on the model object, so callers
+get a ``SharedModel`` wrapper whose inference methods hold the entry's lock:
+threads sharing one set of weights take turns instead of corrupting it.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+try:
+    from ultralytics import YOLO  # type: ignore
+except Exception:
+    YOLO = None
+
+MODELS_ROOT = os.path.join(settings.BASE_DIR, "static", "models")
+SEASON_FOLDERS = {
+    "summer": "germany_summer_ai_model",
+    "winter": "germany_winter_ai_model",
+}
+
+# A loaded model holds fp32 weights plus the module graph; the .pt on disk is
+# usually fp16, so twice the file size is a reasonable resident estimate.
+_MEMORY_FACTOR = 2
+
+
+def season_folder(model_selection: str) -> str:
+    return SEASON_FOLDERS["summer" if model_selection == "summer" else "winter"]
+
+
+def model_dir(model_selection: str) -> str:
+    return os.path.join(MODELS_ROOT, season_folder(model_selection))
+
+
+def resolve_model_path(model_selection: str, model_name: str, fallback: bool = True) -> Optional[str]:
+    """
+    Return the absolute .pt path for (season, name). With ``fallback`` the
+    first .pt in the season folder is used when the name is empty or missing.
+    """
+    folder = model_dir(model_selection)
+    cand = os.path.join(folder, os.path.basename(model_name)) if model_name else None
+    if cand and os.path.exists(cand):
+        return cand
+    if not fallback:
+        return cand
+    pts = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+    pts = [os.path.join(folder, p) for p in pts if p.lower().endswith(".pt")]
+    return pts[0] if pts else None
+
+
+def _file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class SharedModel:
+    """
+    A resident YOLO model shared between threads. ``predict`` / ``__call__``
+    / ``track`` run under one lock per loaded model; every other attribute is
+    passed through to the wrapped model.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.RLock()
+
+    def predict(self, *args, **kwargs):
+        with self.lock:
+            return self.model.predict(*args, **kwargs)
+
+    def track(self, *args, **kwargs):
+        with self.lock:
+            return self.model.track(*args, **kwargs)
+
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            return self.model(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+class _Entry:
+    __slots__ = ("model", "path", "nbytes", "digest")
+
+    def __init__(self, model, path: str, nbytes: int):
+        self.model = SharedModel(model)
+        self.path = path
+        self.nbytes = nbytes
+        self.digest = ""
+
+
+class ModelRegistry:
+    """Thread-safe LRU cache of YOLO models bounded by an estimated byte budget."""
+
+    def __init__(self, budget_bytes: Optional[int] = None):
+        if budget_bytes is None:
+            budget_bytes = int(getattr(settings, "YOLO_MODEL_CACHE_MB", 1024)) * 1024 * 1024
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+        # one lock per key so two requests for the same weights load them once
+        self._loading = {}
+
+    # ---- keys ----
+    @staticmethod
+    def _key(path: str) -> Optional[Tuple]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        folder = os.path.basename(os.path.dirname(path))
+        return (folder, os.path.basename(path), st.st_mtime_ns, st.st_size)
+
+    # ---- public API ----
+    def get(self, model_selection: str, model_name: str, fallback: bool = True):
+        """
+        Return (model_or_None, chosen_path, error_msg), loading on a miss.
+        Mirrors the contract of the old per-request loaders; the model is a
+        ``SharedModel``, so concurrent predict calls are serialised.
+        """
+        if YOLO is None:
+            return None, "", "ultralytics not installed"
+        path = resolve_model_path(model_selection, model_name, fallback=fallback)
+        if not path:
+            return None, model_dir(model_selection), f"no .pt file in {model_dir(model_selection)}"
+        key = self._key(path)
+        if key is None:
+            return None, path, f"model not found: {path}"
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry.model, path, ""
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry.model, path, ""
+            entry = None
+            try:
+                entry = _Entry(YOLO(path), path, key[3] * _MEMORY_FACTOR)
+            except Exception as e:
+                return None, path, f"failed to load model: {e}"
+            finally:
+                # success or not, this load is over: waiters wake up on key_lock
+                # and either find the entry or try the load themselves
+                with self._lock:
+                    if self._loading.get(key) is key_lock:
+                        del self._loading[key]
+                    if entry is not None:
+                        self._drop_stale(key)
+                        self._entries[key] = entry
+                        self._evict()
+            return entry.model, path, ""
+
+    def digest(self, path: str) -> str:
+        """Content hash of a resident model's weights (computed once per entry)."""
+        key = self._key(path)
+        with self._lock:
+            entry = self._entries.get(key) if key else None
+            if entry is not None and entry.digest:
+                return entry.digest
+        digest = _file_digest(path)
+        with self._lock:
+            entry = self._entries.get(key) if key else None
+            if entry is not None:
+                entry.digest = digest
+        return digest
+
+    def invalidate(self, folder: Optional[str] = None, name: Optional[str] = None) -> int:
+        """Drop entries for a season folder and/or file name. Returns the count removed."""
+        with self._lock:
+            doomed = [k for k in self._entries
+                      if (folder is None or k[0] == folder) and (name is None or k[1] == name)]
+            for k in doomed:
+                del self._entries[k]
+            return len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "models": [{"folder": k[0], "name": k[1], "bytes": e.nbytes} for k, e in self._entries.items()],
+                "resident_bytes": sum(e.nbytes for e in self._entries.values()),
+                "budget_bytes": self.budget_bytes,
+            }
+
+    # ---- internals (caller holds self._lock) ----
+    def _drop_stale(self, key: Tuple) -> None:
+        """Remove older versions of the same file and entries whose file vanished."""
+        for k in list(self._entries):
+            same_file = k[0] == key[0] and k[1] == key[1]
+            if same_file or self._key(self._entries[k].path) != k:
+                del self._entries[k]
+
+    def _evict(self) -> None:
+        total = sum(e.nbytes for e in self._entries.values())
+        # always keep the most recently used model, even if it alone exceeds the budget
+        while total > self.budget_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            total -= old.nbytes
+
+
+registry = ModelRegistry()
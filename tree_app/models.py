@@ -4,10 +4,33 @@ class OutputRun(models.Model):
     """
     Optional metadata about a processing run.
     Files themselves live under /static (zip, geojson, images).
+    Also serves as the persistent job queue for the /index pipeline.
     """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
     run_id = models.CharField(max_length=64, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Job state (progress counts images processed / images found)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=DONE, db_index=True)
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Who is running the job ("host:pid") and when it last reported in
+    owner = models.CharField(max_length=128, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
     # Optional label / model metadata
     label = models.CharField(max_length=128, blank=True)
     model = models.CharField(max_length=32, blank=True)
@@ -27,6 +50,9 @@ class OutputRun(models.Model):
     # Convenience thumbnail URL
     thumbnail = models.CharField(max_length=512, blank=True)
 
+    # Free-form per-run metadata (pipeline options, stats)
+    meta = models.JSONField(default=dict, blank=True)
+
     class Meta:
         ordering = ["-created_at"]
 
@@ -0,0 +1,423 @@
+"""
+Processing pipeline for one run: read uploads, inference and GeoJSON
+selection (the result ZIP is streamed on download).  Runs inline for
+synchronous requests or inside a job worker (see jobs.py); all inputs are
+expected under static/input_img/<run_id>.
+"""
+import os
+import glob
+import json
+import shutil
+from collections import namedtuple
+from datetime import datetime
+from itertools import chain
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+
+# ---- Optional deps (safe if missing) ----
+try:
+    import cv2  # type: ignore
+except Exception:
+    cv2 = None
+
+try:
+    import inference  # type: ignore  # project-root annotation helpers
+except Exception:
+    inference = None
+
+try:
+    from .Splitting_TIFF_file_Concise import iter_tiles, save_tile_jpeg  # needs GDAL
+except Exception:
+    iter_tiles = save_tile_jpeg = None
+
+from .batch_inference import decode_images, predict_batched
+from .detection_cache import DetectionCache
+from . import centerlines, georef, zip_reader
+from .model_registry import registry as model_registry
+from .reprojection_cache import ReprojectionCache
+
+# ---------------- paths & helpers ----------------
+BASE_DIR   = settings.BASE_DIR
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+INPUT_ROOT = os.path.join(STATIC_DIR, "input_img")
+RESULT_ROOT= os.path.join(STATIC_DIR, "result")
+ZIP_ROOT   = os.path.join(STATIC_DIR, "zip")
+
+# what a run produces: map data only, annotated images only, or both
+OUTPUT_MODES = ("geojson", "images", "both")
+
+REPROJECTION_CACHE = ReprojectionCache(
+    getattr(settings, "REPROJECTION_CACHE_DIR", os.path.join(BASE_DIR, "cache", "reprojected")),
+    int(getattr(settings, "REPROJECTION_CACHE_MB", 0)) * 1024 * 1024,
+)
+DETECTION_CACHE = DetectionCache(
+    getattr(settings, "DETECTION_CACHE_PATH", os.path.join(BASE_DIR, "cache", "detections.sqlite3")),
+    int(getattr(settings, "DETECTION_CACHE_MB", 0)) * 1024 * 1024,
+)
+
+def _ensure(*dirs):
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+
+_ensure(INPUT_ROOT, RESULT_ROOT, ZIP_ROOT)
+
+def _urlify(p: str) -> str:
+    if not p: return ""
+    p = p.replace("\\", "/")
+    return p if p.startswith("/") else f"/{p}"
+
+def _ts() -> str:
+    dt, micro = datetime.utcnow().strftime("%Y%m%d%H%M%S.%f").split(".")
+    return f"{dt}{int(micro)//1000:03d}"
+
+# Files the pipeline writes next to the uploads (GeoTIFFs and images taken out
+# of ZIPs, tile JPEGs + .jgw, tile indexes) live in this subfolder of the run's
+# input dir, which the input scans skip: processing a run again (a requeued
+# job) must not pick them up as extra inputs.
+DERIVED_DIR = "derived"
+
+def _scan_images(root_dir: str) -> List[str]:
+    """Uploaded images under root_dir (pipeline output and session state excluded)."""
+    imgs = []
+    for r, dirs, files in os.walk(root_dir):
+        if r == root_dir:
+            dirs[:] = [d for d in dirs if d != DERIVED_DIR]
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for fn in files:
+            if fn.lower().endswith((".jpg", ".jpeg", ".png")):
+                imgs.append(os.path.join(r, fn))
+    return imgs
+
+def download_url(run_id: str) -> str:
+    """URL streaming the run's result folder as a ZIP (views.run_download)."""
+    return _urlify(f"runs/{run_id}/download/")
+
+def _write_annotated(out_abs: str, res, details=None) -> bool:
+    """
+    Write the annotated image of one YOLO result to out_abs (``details`` is
+    a ready annotate_result tuple, if any). Returns False on failure.
+    """
+    if cv2 is None:
+        return False
+    try:
+        if details is None and inference is not None:
+            details = inference.annotate_result(res)
+        if details is not None:
+            flag, annotated, *_ = details
+            if flag:
+                # annotated is the BGR buffer drawn in place; encode it directly
+                return bool(cv2.imwrite(out_abs, annotated, [cv2.IMWRITE_JPEG_QUALITY, 90]))
+        return bool(cv2.imwrite(out_abs, res.plot()))
+    except Exception:
+        pass
+    return False
+
+def _save_json(abs_path: str, data) -> None:
+    _ensure(os.path.dirname(abs_path))
+    with open(abs_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+def _copy(src: str, dst: str) -> None:
+    if os.path.abspath(src) != os.path.abspath(dst):
+        _ensure(os.path.dirname(dst))
+        shutil.copyfile(src, dst)
+
+def _is_nonempty_geojson(p: str) -> bool:
+    try:
+        if not p or not os.path.exists(p) or os.path.getsize(p) <= 2:
+            return False
+        with open(p, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return isinstance(data, dict) and data.get("type") == "FeatureCollection"
+    except Exception:
+        return False
+
+def _pick_geojson_for_run(run_result_dir: str) -> Optional[str]:
+    """
+    Best-geojson strategy (no blank file creation here):
+      1) Any *.geojson INSIDE this run's result folder (prefer first)
+      2) static/tiff_output.geojson if non-empty & valid
+      3) existing static/output.geojson if non-empty & valid
+      4) None  (caller may decide to create a tiny placeholder)
+    """
+    # 1)
+    run_geojsons = sorted(glob.glob(os.path.join(run_result_dir, "*.geojson")))
+    for gj in run_geojsons:
+        if _is_nonempty_geojson(gj):
+            return gj
+
+    # 2)
+    tiff_gj = os.path.join(STATIC_DIR, "tiff_output.geojson")
+    if _is_nonempty_geojson(tiff_gj):
+        return tiff_gj
+
+    # 3)
+    public_gj = os.path.join(STATIC_DIR, "output.geojson")
+    if _is_nonempty_geojson(public_gj):
+        return public_gj
+
+    # 4) none
+    return None
+
+# ---------------- PIPELINE ----------------
+def _zip_uploads(run_input_dir: str, derived_dir: str):
+    """
+    Index the uploaded ZIPs without extracting them: returns (image members,
+    GeoTIFF paths). Only GeoTIFF members are written out (under derived_dir),
+    since GDAL reads them by window from disk; images are decoded from the
+    archive.
+    """
+    members: List[zip_reader.ZipMember] = []
+    tifs: List[str] = []
+    for fn in sorted(os.listdir(run_input_dir)):
+        if not fn.lower().endswith(".zip"):
+            continue
+        zip_abs = os.path.join(run_input_dir, fn)
+        images, tif_names = zip_reader.scan_zip(zip_abs)
+        members.extend(images)
+        for name in tif_names:
+            dest = os.path.join(derived_dir, name)
+            zip_reader.write_member(zip_abs, name, dest)
+            tifs.append(dest)
+    return members, tifs
+
+# An image read straight from an uploaded ZIP; rel is its member name
+_ZipItem = namedtuple("_ZipItem", ["rel", "data", "geotransform"])
+
+def _zip_items(members, decode: bool, on_invalid: Callable[[str], None]):
+    """
+    Yield (_ZipItem, BGR array) for every ZIP image, inflated and decoded in
+    parallel. With ``decode`` members that do not decode are dropped (and
+    reported through on_invalid) instead of reaching inference.
+    """
+    members_stream = zip_reader.iter_members(members, decode_images=decode,
+                                             workers=getattr(settings, "ZIP_DECODE_WORKERS", 1))
+    for m, data, img, gt in members_stream:
+        if decode and img is None:
+            on_invalid(m.name)
+            continue
+        yield _ZipItem(m.name, data, gt), img
+
+# A GeoTIFF tile on its way through inference; rel is its path under the run dirs
+_TileItem = namedtuple("_TileItem", ["rel", "tile"])
+
+def _scan_tifs(run_input_dir: str) -> List[str]:
+    return sorted(os.path.join(run_input_dir, fn) for fn in os.listdir(run_input_dir)
+                  if fn.lower().endswith((".tif", ".tiff")))
+
+def _tile_items(tif_abs: str, derived_dir: str, on_grid: Callable[[int], None],
+                on_skip: Callable[[str, float], None], source_hash: Optional[str] = None):
+    """Yield (_TileItem, BGR array) for every non-empty tile of a GeoTIFF as it is cut."""
+    stem = os.path.splitext(os.path.basename(tif_abs))[0]
+    tiles = iter_tiles(
+        tif_abs,
+        # tile index lives with the run's inputs, never in shared static/
+        index_path=os.path.join(derived_dir, stem, "0_Tiles_Geo_Coordinates.txt"),
+        workers=getattr(settings, "TIFF_TILE_WORKERS", 1),
+        min_valid_fraction=getattr(settings, "TIFF_MIN_VALID_FRACTION", 0.0),
+        on_grid=on_grid,
+        on_skip=lambda name, frac: on_skip(os.path.join(stem, name), frac),
+        reprojection_cache=REPROJECTION_CACHE,
+        source_hash=source_hash,
+    )
+    for tile in tiles:
+        yield _TileItem(os.path.join(stem, f"{tile.name}.jpeg"), tile), tile.array
+
+def run_pipeline(run_id: str, model_selection: str, model_name: str,
+                 progress: Optional[Callable[[int, int], None]] = None,
+                 output: str = "both", source_hashes: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    Process the uploads already saved in static/input_img/<run_id>.
+    ``progress(done, total)`` is called after every image. With
+    ``output="geojson"`` nothing is rendered and no result JPEGs are written;
+    with ``output="images"`` no GeoJSON (nor centerlines) is produced and the
+    public static/output.geojson is left untouched.
+    ``source_hashes`` maps upload file names to the SHA-256 computed while
+    they were received, so GeoTIFFs are not hashed again.
+    Returns the response payload (paths are URLs).
+    """
+    run_input_dir  = os.path.join(INPUT_ROOT, run_id)
+    run_result_dir = os.path.join(RESULT_ROOT, run_id)
+    derived_dir    = os.path.join(run_input_dir, DERIVED_DIR)
+    _ensure(run_input_dir, run_result_dir)
+    zip_members, zip_tifs = _zip_uploads(run_input_dir, derived_dir)
+    source_hashes = source_hashes or {}
+
+    # optional YOLO (resident across requests, see model_registry)
+    model, model_path, _ = model_registry.get(model_selection, model_name)
+
+    input_image_list: List[str] = []
+    output_image_list: List[str] = []
+
+    originals = _scan_images(run_input_dir)
+
+    tifs = sorted(set(_scan_tifs(run_input_dir) + zip_tifs)) if iter_tiles is not None else []
+    total = len(originals) + len(zip_members)
+    done = 0
+
+    skipped_tiles: List[Dict] = []
+    invalid_images: List[str] = []
+
+    def on_grid(n: int) -> None:
+        # runs on the prefetch thread; the loop below reports the new total
+        nonlocal total
+        total += n
+
+    def on_skip(name: str, valid_fraction: float) -> None:
+        nonlocal total
+        total -= 1
+        skipped_tiles.append({"tile": name, "valid_fraction": round(valid_fraction, 4)})
+
+    def on_invalid(name: str) -> None:
+        nonlocal total
+        total -= 1
+        invalid_images.append(name)
+
+    use_model = model is not None and cv2 is not None
+    # GeoTIFFs are cut lazily: the tiler is the producer feeding the bounded
+    # prefetch queue of predict_batched, so splitting overlaps with inference
+    items = chain(
+        decode_images(originals) if use_model else ((p, None) for p in originals),
+        _zip_items(zip_members, decode=use_model, on_invalid=on_invalid),
+        *(_tile_items(t, derived_dir, on_grid, on_skip, source_hashes.get(os.path.basename(t))) for t in tifs),
+    )
+
+    # batched inference: decode in a prefetch thread, one predict call per batch
+    if use_model:
+        imgsz, conf, iou = 1024, 0.25, 0.45
+        # re-submitted tiles skip predict() and go straight to annotation
+        det_cache = (DETECTION_CACHE.bind(model_registry.digest(model_path), conf=conf, iou=iou, imgsz=imgsz)
+                     if DETECTION_CACHE.enabled else None)
+        stream = predict_batched(
+            model, items,
+            batch_size=getattr(settings, "YOLO_BATCH_SIZE", 8),
+            prefetch=getattr(settings, "YOLO_PREFETCH_BATCHES", 2),
+            imgsz=imgsz, conf=conf, iou=iou, device="cpu", cache=det_cache,
+        )
+    else:
+        stream = ((k, img, None) for k, img in items)
+
+    if progress:
+        progress(0, total)
+
+    want_images = output != "geojson"
+    want_geojson = output != "images"
+    # features are streamed to the run GeoJSON as images come out of inference
+    geojson_abs = os.path.join(run_result_dir, f"{run_id}.geojson")
+    seq_abs = (os.path.join(run_result_dir, f"{run_id}.geojsonl")
+               if getattr(settings, "GEOJSON_SEQ", False) else None)
+    writer: Optional[georef.GeoJSONWriter] = None
+    try:
+        for key, _, res in stream:
+            done += 1
+            if isinstance(key, _TileItem):
+                rel = key.rel
+                abs_img = os.path.join(derived_dir, rel)
+                if want_images:
+                    _ensure(os.path.dirname(abs_img))
+                    save_tile_jpeg(key.tile, abs_img)  # served back as the input image (+ .jgw)
+            elif isinstance(key, _ZipItem):
+                rel = key.rel
+                abs_img = os.path.join(derived_dir, rel)
+                if want_images:
+                    # only materialised because it is served back as an input image
+                    _ensure(os.path.dirname(abs_img))
+                    with open(abs_img, "wb") as f:
+                        f.write(key.data)
+            else:
+                abs_img = key
+                rel = os.path.relpath(abs_img, run_input_dir)
+
+            details = None
+            if res is not None and inference is not None:
+                details = inference.annotate_result(res, render=want_images)
+            if details is not None and want_geojson:
+                if isinstance(key, _TileItem):
+                    gt = key.tile.geotransform
+                elif isinstance(key, _ZipItem):
+                    gt = key.geotransform
+                else:
+                    gt = georef.read_world_file(os.path.splitext(abs_img)[0] + ".jgw")
+                if details[0] and gt is not None:
+                    if writer is None:
+                        writer = georef.GeoJSONWriter(geojson_abs, model_selection, seq_abs)
+                    writer.write_tile(georef.tile_detections(os.path.basename(rel), res, details[5], gt))
+
+            if want_images:
+                out_abs = os.path.join(run_result_dir, rel)
+                _ensure(os.path.dirname(out_abs))
+                wrote = _write_annotated(out_abs, res, details) if res is not None else False
+                if not wrote:
+                    shutil.copyfile(abs_img, out_abs)
+                output_image_list.append(_urlify(os.path.join("static", "result", run_id, rel)))
+            if os.path.exists(abs_img):
+                input_image_list.append(_urlify(os.path.relpath(abs_img, BASE_DIR)))
+            if progress:
+                progress(done, total)
+    finally:
+        if writer is not None:
+            writer.close()  # closes the FeatureCollection array
+
+    # the writer knows what it wrote: no need to parse the run GeoJSON back
+    has_features = writer is not None and writer.count > 0
+
+    # merged path centerlines (components in a process pool), next to the run GeoJSON;
+    # there is no writer (so no centerline pass) with output="images"
+    centerline_stats: Optional[centerlines.CenterlineStats] = None
+    if has_features and centerlines.available():
+        try:
+            centerline_stats = centerlines.process_geojson(
+                geojson_abs,
+                getattr(settings, "CENTERLINE_TOLERANCE", 10),
+                os.path.join(run_result_dir, f"{run_id}_centerlines.geojson"),
+                workers=getattr(settings, "CENTERLINE_WORKERS", None),
+            )
+        except Exception as e:
+            print(f"Centerline extraction failed: {e}")
+
+    public_geojson_abs = os.path.join(STATIC_DIR, "output.geojson")
+    if has_features:
+        # this run's own GeoJSON, written (and closed) above
+        _copy(geojson_abs, public_geojson_abs)
+    elif want_geojson:
+        # ---- Choose best GeoJSON for this run (never blank out a good one) ----
+        chosen_geojson_abs = _pick_geojson_for_run(run_result_dir)
+        if chosen_geojson_abs is None:
+            # create a minimal placeholder ONLY if nothing exists anywhere
+            chosen_geojson_abs = os.path.join(run_result_dir, f"{run_id}.geojson")
+            _save_json(chosen_geojson_abs, {"type": "FeatureCollection", "features": []})
+
+        # Update the public file ONLY by copying a non-empty, valid geojson
+        if _is_nonempty_geojson(chosen_geojson_abs):
+            _copy(chosen_geojson_abs, public_geojson_abs)
+
+        # ---- The result ZIP is streamed on demand (see download_url) ----
+        # If the chosen geojson is not inside the run folder, put a copy there as <run_id>.geojson
+        try:
+            same_tree = os.path.commonpath([os.path.abspath(run_result_dir), os.path.abspath(chosen_geojson_abs)]) == os.path.abspath(run_result_dir)
+        except Exception:
+            same_tree = False
+        if not same_tree and os.path.exists(chosen_geojson_abs):
+            try:
+                _copy(chosen_geojson_abs, os.path.join(run_result_dir, f"{run_id}.geojson"))
+            except Exception:
+                pass
+
+    return {
+        "run_id": run_id,
+        "zip_path": download_url(run_id),
+        "geojson_path": (_urlify(os.path.relpath(public_geojson_abs, BASE_DIR))
+                         if want_geojson and os.path.exists(public_geojson_abs) else ""),
+        "input_image_list": input_image_list,
+        "output_image_list": output_image_list,
+        "meta": {
+            "skipped_tiles": skipped_tiles,
+            "invalid_images": invalid_images,
+            "geojsonseq_path": _urlify(os.path.relpath(seq_abs, BASE_DIR)) if writer and seq_abs else "",
+            "centerline_timings": centerline_stats.timings if centerline_stats else {},
+            "centerline_counts": ({"components": centerline_stats.components,
+                                   "centerlines": centerline_stats.centerlines}
+                                  if centerline_stats else {}),
+        },
+    }
@@ -0,0 +1,24 @@
+"""
+Thread-pool helpers shared by the GeoTIFF tiler and the ZIP reader.
+"""
+from collections import deque
+from typing import Callable, Iterable, Iterator
+
+
+def ordered_map(pool, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    fn(item) on the pool with at most ``window`` calls in flight, results
+    yielded in input order. Closing the generator cancels what is still
+    queued.
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
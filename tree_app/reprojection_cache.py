@@ -0,0 +1,159 @@
+"""
+Content-addressed cache of reprojected rasters.
+
+Operators re-submit the same orthophoto many times (other season / weights),
+so the UTM warp is stored once as a tiled, DEFLATE-compressed GeoTIFF keyed
+by (source file hash, target CRS). The directory is capped in bytes and
+evicted least-recently-used first (a hit refreshes the file's mtime).
+
+Every entry has a ``.lock`` file next to it (POSIX ``flock``). A run holds a
+shared lock (its ``Pin``) for as long as it reads the raster, so eviction
+triggered by another run skips it; a miss builds under the exclusive lock,
+so concurrent misses for the same key warp once and the others reuse it.
+"""
+import hashlib
+import os
+import uuid
+from typing import Callable, Optional, Tuple
+
+try:
+    import fcntl  # type: ignore  # POSIX only; without it entries are not pinned
+except ImportError:
+    fcntl = None
+
+_CREATION_OPTIONS = ["TILED=YES", "COMPRESS=DEFLATE", "PREDICTOR=2", "BIGTIFF=IF_SAFER"]
+
+
+def file_sha256(path: str, chunk_size: int = 4 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Pin:
+    """Shared lock on one cache entry; the entry is not evicted until ``release``."""
+
+    def __init__(self, fd: Optional[int]):
+        self._fd = fd
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+def _lock(path: str, exclusive: bool = False, block: bool = True) -> Optional[int]:
+    """flock the entry's .lock file; returns the fd to release (None without fcntl)."""
+    if fcntl is None:
+        return None
+    mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not block:
+        mode |= fcntl.LOCK_NB
+    lock_path = f"{path}.lock"
+    while True:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, mode)
+        except OSError:
+            os.close(fd)
+            raise
+        # evict() unlinks the lock file along with its entry; a lock taken on
+        # the unlinked inode would not exclude anyone, so retry on the new file
+        try:
+            if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+                return fd
+        except OSError:
+            pass
+        os.close(fd)
+
+
+class ReprojectionCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path_for(self, source_hash: str, dst_wkt: str) -> str:
+        crs_hash = hashlib.sha256(dst_wkt.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, f"{source_hash[:40]}_{crs_hash[:16]}.tif")
+
+    def get_or_create(self, source_path: str, dst_wkt: str,
+                      build: Callable[[str, list], None],
+                      source_hash: Optional[str] = None) -> Tuple[str, Pin]:
+        """
+        Return (path, pin) of the cached raster for (source, CRS). On a miss
+        ``build(tmp_path, creation_options)`` must write the reprojected
+        GeoTIFF to tmp_path; it is then published atomically so concurrent
+        readers never see a partial file. The entry stays on disk until the
+        caller releases the pin.
+        """
+        source_hash = source_hash or file_sha256(source_path)
+        path = self.path_for(source_hash, dst_wkt)
+        os.makedirs(self.root, exist_ok=True)
+
+        fd = _lock(path)
+        if not os.path.exists(path) and fd is not None:
+            # builds are serialised per key: wait for (or become) the builder
+            Pin(fd).release()
+            fd = _lock(path, exclusive=True)
+        try:
+            if os.path.exists(path):
+                try:
+                    os.utime(path)  # LRU: mark as recently used
+                except OSError:
+                    pass
+                print(f"\nReprojection cache hit: {path}")
+            else:
+                tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+                try:
+                    build(tmp, list(_CREATION_OPTIONS))
+                    os.replace(tmp, path)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH)  # downgrade: keep it pinned while in use
+        except BaseException:
+            Pin(fd).release()
+            raise
+        self.evict(keep=path)
+        return path, Pin(fd)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Delete least-recently-used rasters until the cache fits max_bytes."""
+        entries = []
+        for fn in os.listdir(self.root):
+            if not fn.endswith(".tif"):
+                continue
+            p = os.path.join(self.root, fn)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        total = sum(e[1] for e in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            try:
+                fd = _lock(p, exclusive=True, block=False)
+            except OSError:
+                continue  # pinned by a run that is still reading it
+            try:
+                os.remove(p)
+                total -= size
+                # Unlinked while still held, so no one can lock the old inode
+                # and believe they own the entry
+                os.remove(f"{p}.lock")
+            except OSError:
+                pass
+            finally:
+                Pin(fd).release()
@@ -0,0 +1,95 @@
+"""
+Upload handler that spools multipart files straight into a run directory.
+
+Django's default handlers keep uploads up to FILE_UPLOAD_MAX_MEMORY_SIZE in
+RAM and otherwise go through a temp file that the view then copies. This
+handler writes each chunk directly to ``<target_dir>/<basename>``, hashes it
+(SHA-256) on the way and stops the request once it passes the configured
+ceilings, so memory stays at one chunk per upload whatever the file size.
+"""
+import hashlib
+import os
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+
+
+def max_request_bytes() -> int:
+    return int(getattr(settings, "UPLOAD_MAX_REQUEST_BYTES", 0))
+
+
+def max_file_bytes() -> int:
+    return int(getattr(settings, "UPLOAD_MAX_FILE_BYTES", 0))
+
+
+class SpooledRunFile(UploadedFile):
+    """An upload already written to ``path``; ``sha256`` is its content hash."""
+
+    def __init__(self, path: str, name: str, content_type: str, size: int, sha256: str, charset=None):
+        super().__init__(None, name, content_type, size, charset)
+        self.path = path
+        self.sha256 = sha256
+
+    def open(self, mode="rb"):
+        self.file = open(self.path, mode)
+        return self
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def chunks(self, chunk_size=None):
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size or self.DEFAULT_CHUNK_SIZE), b""):
+                yield chunk
+
+
+class RunDirectoryUploadHandler(FileUploadHandler):
+    def __init__(self, request, target_dir: str):
+        super().__init__(request)
+        self.target_dir = target_dir
+        self.too_large: Optional[str] = None  # reason, once a ceiling was hit
+        self._request_bytes = 0
+        self._f = None
+        self._path = ""
+        self._hash = None
+        self._size = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        os.makedirs(self.target_dir, exist_ok=True)
+        self._path = os.path.join(self.target_dir, os.path.basename(self.file_name))
+        self._f = open(self._path, "wb")
+        self._hash = hashlib.sha256()
+        self._size = 0
+        raise StopFutureHandlers()
+
+    def _abort(self, reason: str):
+        self.too_large = reason
+        self._f.close()
+        os.remove(self._path)
+        raise StopUpload(connection_reset=True)
+
+    def receive_data_chunk(self, raw_data, start):
+        self._size += len(raw_data)
+        self._request_bytes += len(raw_data)
+        if max_file_bytes() and self._size > max_file_bytes():
+            self._abort(f"{self.file_name} exceeds {max_file_bytes()} bytes")
+        if max_request_bytes() and self._request_bytes > max_request_bytes():
+            self._abort(f"request exceeds {max_request_bytes()} bytes")
+        self._f.write(raw_data)
+        self._hash.update(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self._f.close()
+        return SpooledRunFile(self._path, self.file_name, self.content_type, self._size,
+                              self._hash.hexdigest(), self.charset)
+
+    def upload_interrupted(self):
+        if self._f is not None and not self._f.closed:
+            self._f.close()
+            if os.path.exists(self._path):
+                os.remove(self._path)
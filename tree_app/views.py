@@ -1,128 +1,28 @@
 import os
-import glob
 import json
 import shutil
-import zipfile
 from datetime import datetime
-from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict
 
 from django.conf import settings
-from django.http import JsonResponse, HttpRequest, HttpResponse
+from django.http import JsonResponse, HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods, require_GET
 from django.contrib.auth import authenticate, login, logout, get_user_model
 
-# ---- Optional deps (safe if missing) ----
-try:
-    from ultralytics import YOLO  # type: ignore
-except Exception:
-    YOLO = None
-
-try:
-    import cv2  # type: ignore
-except Exception:
-    cv2 = None
-
-try:
-    from PIL import Image as PILImage  # type: ignore
-except Exception:
-    PILImage = None
+from . import chunked_upload, jobs
+from .model_registry import registry as model_registry
+from .models import OutputRun
+from .upload_handlers import RunDirectoryUploadHandler, SpooledRunFile, max_file_bytes, max_request_bytes
+from .pipeline import (
+    BASE_DIR, STATIC_DIR, INPUT_ROOT, RESULT_ROOT, OUTPUT_MODES,
+    _ensure, _urlify, _ts, _save_json, _pick_geojson_for_run, download_url,
+)
+from .zip_stream import folder_entries, stream_zip
 
 User = get_user_model()
 
-# ---------------- paths & helpers ----------------
-BASE_DIR   = settings.BASE_DIR
-STATIC_DIR = os.path.join(BASE_DIR, "static")
-INPUT_ROOT = os.path.join(STATIC_DIR, "input_img")
-RESULT_ROOT= os.path.join(STATIC_DIR, "result")
-ZIP_ROOT   = os.path.join(STATIC_DIR, "zip")
-
-def _ensure(*dirs):
-    for d in dirs:
-        os.makedirs(d, exist_ok=True)
-
-_ensure(INPUT_ROOT, RESULT_ROOT, ZIP_ROOT)
-
-def _urlify(p: str) -> str:
-    if not p: return ""
-    p = p.replace("\\", "/")
-    return p if p.startswith("/") else f"/{p}"
-
-def _ts() -> str:
-    dt, micro = datetime.utcnow().strftime("%Y%m%d%H%M%S.%f").split(".")
-    return f"{dt}{int(micro)//1000:03d}"
-
-def _scan_images(root_dir: str) -> List[str]:
-    imgs = []
-    for r, _, files in os.walk(root_dir):
-        for fn in files:
-            if fn.lower().endswith((".jpg", ".jpeg", ".png")):
-                imgs.append(os.path.join(r, fn))
-    return imgs
-
-def _zip_folder_with_extra(src_folder: str, zip_abs_path: str, extra_files: List[str]) -> None:
-    """Zip src_folder, then add extra_files at the root of the zip."""
-    _ensure(os.path.dirname(zip_abs_path))
-    with zipfile.ZipFile(zip_abs_path, "w", zipfile.ZIP_DEFLATED) as z:
-        for root, _, files in os.walk(src_folder):
-            for f in files:
-                abs_f = os.path.join(root, f)
-                rel_f = os.path.relpath(abs_f, src_folder)
-                z.write(abs_f, rel_f)
-        # add extras at root
-        for ef in extra_files:
-            if ef and os.path.exists(ef) and os.path.getsize(ef) > 0:
-                z.write(ef, os.path.basename(ef))
-
-def _save_json(abs_path: str, data) -> None:
-    _ensure(os.path.dirname(abs_path))
-    with open(abs_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-def _copy(src: str, dst: str) -> None:
-    if os.path.abspath(src) != os.path.abspath(dst):
-        _ensure(os.path.dirname(dst))
-        shutil.copyfile(src, dst)
-
-def _is_nonempty_geojson(p: str) -> bool:
-    try:
-        if not p or not os.path.exists(p) or os.path.getsize(p) <= 2:
-            return False
-        with open(p, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return isinstance(data, dict) and data.get("type") == "FeatureCollection"
-    except Exception:
-        return False
-
-def _pick_geojson_for_run(run_result_dir: str) -> Optional[str]:
-    """
-    Best-geojson strategy (no blank file creation here):
-      1) Any *.geojson INSIDE this run's result folder (prefer first)
-      2) static/tiff_output.geojson if non-empty & valid
-      3) existing static/output.geojson if non-empty & valid
-      4) None  (caller may decide to create a tiny placeholder)
-    """
-    # 1)
-    run_geojsons = sorted(glob.glob(os.path.join(run_result_dir, "*.geojson")))
-    for gj in run_geojsons:
-        if _is_nonempty_geojson(gj):
-            return gj
-
-    # 2)
-    tiff_gj = os.path.join(STATIC_DIR, "tiff_output.geojson")
-    if _is_nonempty_geojson(tiff_gj):
-        return tiff_gj
-
-    # 3)
-    public_gj = os.path.join(STATIC_DIR, "output.geojson")
-    if _is_nonempty_geojson(public_gj):
-        return public_gj
-
-    # 4) none
-    return None
-
 # ---------------- AUTH (unchanged) ----------------
 @csrf_exempt
 def signup_request(request: HttpRequest) -> HttpResponse:
@@ -188,6 +88,7 @@ def model_upload(request: HttpRequest) -> HttpResponse:
         with open(os.path.join(dst_dir, f.name), "wb") as out:
             for chunk in f.chunks():
                 out.write(chunk)
+        model_registry.invalidate(folder=os.path.basename(dst_dir), name=f.name)
         return JsonResponse({"status": True, "message": "Model Upload Successfully"})
 
     summer_dir = os.path.join(STATIC_DIR, "models", "germany_summer_ai_model")
@@ -214,6 +115,7 @@ def delete_file(request: HttpRequest) -> HttpResponse:
         ):
             if os.path.exists(p):
                 os.remove(p)
+                model_registry.invalidate(folder=os.path.basename(os.path.dirname(p)), name=filename)
                 return JsonResponse({"success": True})
         return JsonResponse({"success": False, "error": "File not found"})
     return JsonResponse({"success": False, "error": "Invalid request"})
@@ -222,127 +124,194 @@ def delete_file(request: HttpRequest) -> HttpResponse:
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
 def index(request: HttpRequest) -> HttpResponse:
+    """
+    POST saves the uploads under static/input_img/<run_id> and queues the
+    run for the worker pool (manage.py run_workers), returning the run_id
+    straight away; poll /jobs/<run_id>/ for progress and artifacts.
+    Send sync=1 to process inside the request as before, and
+    output=geojson|images|both (default both) to choose the artifacts.
+    """
     if request.method == "GET":
         return render(request, "index.html")
 
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        content_length = 0
+    if max_request_bytes() and content_length > max_request_bytes():
+        return JsonResponse({"status": False, "error": f"request exceeds {max_request_bytes()} bytes"}, status=413)
+
     run_id = _ts()
     run_input_dir  = os.path.join(INPUT_ROOT, run_id)
     run_result_dir = os.path.join(RESULT_ROOT, run_id)
     _ensure(run_input_dir, run_result_dir)
 
-    # receive files
+    # receive files: spooled chunk by chunk straight into the run dir (hashed on the way)
+    handler = RunDirectoryUploadHandler(request, run_input_dir)
+    request.upload_handlers = [handler]
     zip_file = request.FILES.get("file")
     tif_file = request.FILES.get("tif_file")
+    if handler.too_large:
+        shutil.rmtree(run_input_dir, ignore_errors=True)
+        shutil.rmtree(run_result_dir, ignore_errors=True)
+        return JsonResponse({"status": False, "error": handler.too_large}, status=413)
     model_selection = request.POST.get("model", "summer").strip()
     model_name = request.POST.get("model_name", "").strip()
+    label = request.POST.get("label", "").strip()
+    sync = request.POST.get("sync", "").strip().lower() in {"1", "true", "yes"}
+    output = request.POST.get("output", "both").strip().lower() or "both"
+    if output not in OUTPUT_MODES:
+        # the uploads were already spooled into the run dir: don't leave them behind
+        shutil.rmtree(run_input_dir, ignore_errors=True)
+        shutil.rmtree(run_result_dir, ignore_errors=True)
+        return JsonResponse({"status": False, "error": f"output must be one of {', '.join(OUTPUT_MODES)}"}, status=400)
+
+    # the handler already wrote the files; keep their hashes for the reprojection cache
+    source_hashes = {os.path.basename(u.name): u.sha256 for u in (zip_file, tif_file)
+                     if isinstance(u, SpooledRunFile)}
+
+    # sync jobs are created already claimed by this process, so no worker can take them
+    job = jobs.enqueue(run_id, model_selection, model_name, label=label,
+                       input_dir=run_input_dir, result_dir=run_result_dir,
+                       options={"output": output, "source_hashes": source_hashes}, running=sync)
+
+    if sync:
+        try:
+            payload = jobs.run_job(job)
+        except Exception as e:
+            return JsonResponse({"status": False, "run_id": run_id, "error": f"{type(e).__name__}: {e}"})
+        return JsonResponse({"status": True, **payload})
 
-    if zip_file:
-        save_abs = os.path.join(run_input_dir, zip_file.name)
-        with open(save_abs, "wb") as f:
-            for c in zip_file.chunks():
-                f.write(c)
+    return JsonResponse({
+        "status": True,
+        "run_id": run_id,
+        "job_status": job.status,
+        "status_url": _urlify(f"jobs/{run_id}/"),
+    })
+
+# ---------------- RESUMABLE UPLOADS ----------------
+def _upload_session(run_id: str):
+    """(run_input_dir, manifest) of an open chunked upload, or an error response."""
+    if not chunked_upload.valid_run_id(run_id):
+        return None, JsonResponse({"status": False, "error": "invalid run_id"}, status=400)
+    run_input_dir = os.path.join(INPUT_ROOT, run_id)
+    manifest = chunked_upload.load_manifest(run_input_dir)
+    if manifest is None:
+        return None, JsonResponse({"status": False, "error": "no open upload for this run"}, status=404)
+    return (run_input_dir, manifest), None
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def upload_init(request: HttpRequest) -> HttpResponse:
+    """
+    Start a resumable upload of one ZIP/GeoTIFF. Fields: filename, size,
+    sha256 (here or at finalize), and the /index options (model,
+    model_name, label, output). Then PUT the bytes to upload_url?offset=N
+    in any order (in parallel if you like), GET upload_url for the ranges
+    still missing, and POST finalize_url to queue the run.
+    """
+    try:
+        size = int(request.POST.get("size", "0"))
+    except ValueError:
+        size = 0
+    if max_file_bytes() and size > max_file_bytes():
+        return JsonResponse({"status": False, "error": f"file exceeds {max_file_bytes()} bytes"}, status=413)
+    output = request.POST.get("output", "both").strip().lower() or "both"
+    if output not in OUTPUT_MODES:
+        return JsonResponse({"status": False, "error": f"output must be one of {', '.join(OUTPUT_MODES)}"}, status=400)
+
+    for stale in chunked_upload.sweep_expired(INPUT_ROOT, getattr(settings, "UPLOAD_SESSION_TTL_SECONDS", 24 * 3600)):
         try:
-            with zipfile.ZipFile(save_abs, "r") as z:
-                z.extractall(run_input_dir)
-        except Exception:
+            os.rmdir(os.path.join(RESULT_ROOT, stale))  # left empty by sessions opened before finalize made it
+        except OSError:
             pass
 
-    if tif_file:
-        tif_abs = os.path.join(run_input_dir, tif_file.name)
-        with open(tif_abs, "wb") as f:
-            for c in tif_file.chunks():
-                f.write(c)
+    run_id = _ts()
+    run_input_dir = os.path.join(INPUT_ROOT, run_id)
+    _ensure(run_input_dir)
+    try:
+        manifest = chunked_upload.init(
+            run_input_dir, request.POST.get("filename", ""), size,
+            sha256=request.POST.get("sha256", "").strip(),
+            options={
+                "model": request.POST.get("model", "summer").strip(),
+                "model_name": request.POST.get("model_name", "").strip(),
+                "label": request.POST.get("label", "").strip(),
+                "output": output,
+            },
+        )
+    except chunked_upload.UploadError as e:
+        shutil.rmtree(run_input_dir, ignore_errors=True)
+        return JsonResponse({"status": False, "error": str(e)}, status=e.status)
 
-    # optional YOLO
-    model = None
-    if YOLO is not None:
+    return JsonResponse({
+        "status": True,
+        "run_id": run_id,
+        "filename": manifest["filename"],
+        "size": manifest["size"],
+        "chunk_size": getattr(settings, "UPLOAD_CHUNK_BYTES", 8 * 1024 * 1024),
+        "upload_url": _urlify(f"uploads/{run_id}/"),
+        "finalize_url": _urlify(f"uploads/{run_id}/finalize/"),
+    })
+
+@csrf_exempt
+@require_http_methods(["GET", "PUT"])
+def upload_chunk(request: HttpRequest, run_id: str) -> HttpResponse:
+    """GET: received / missing byte ranges. PUT ?offset=N: write the body at offset N."""
+    session, error = _upload_session(run_id)
+    if error:
+        return error
+    run_input_dir, manifest = session
+
+    if request.method == "PUT":
         try:
-            base_models = os.path.join(STATIC_DIR, "models")
-            folder = "germany_summer_ai_model" if model_selection == "summer" else "germany_winter_ai_model"
-            model_dir = os.path.join(base_models, folder)
-            cand = os.path.join(model_dir, model_name) if model_name else None
-            if not cand or not os.path.exists(cand):
-                pts = [p for p in os.listdir(model_dir)] if os.path.isdir(model_dir) else []
-                pts = [os.path.join(model_dir, p) for p in pts if p.lower().endswith(".pt")]
-                cand = pts[0] if pts else None
-            if cand and os.path.exists(cand):
-                model = YOLO(cand)
-        except Exception:
-            model = None
+            offset = int(request.GET.get("offset", ""))
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            return JsonResponse({"status": False, "error": "offset and Content-Length are required"}, status=400)
+        try:
+            # streamed from the socket; request.body would buffer the chunk in memory
+            chunked_upload.write_chunk(run_input_dir, manifest, offset, length, request)
+        except chunked_upload.UploadError as e:
+            return JsonResponse({"status": False, "error": str(e)}, status=e.status)
 
-    input_image_list: List[str] = []
-    output_image_list: List[str] = []
+    return JsonResponse({"status": True, "run_id": run_id, **chunked_upload.status(run_input_dir, manifest)})
 
-    originals = _scan_images(run_input_dir)
-    # also support single images at root
-    if not originals:
-        for fn in os.listdir(run_input_dir):
-            if fn.lower().endswith((".jpg", ".jpeg", ".png")):
-                originals.append(os.path.join(run_input_dir, fn))
-
-    for abs_img in originals:
-        rel = os.path.relpath(abs_img, run_input_dir)
-        out_abs = os.path.join(run_result_dir, rel)
-        _ensure(os.path.dirname(out_abs))
-
-        wrote = False
-        if model is not None and PILImage is not None and cv2 is not None:
-            try:
-                _ = PILImage.open(abs_img)
-                res = model.predict(source=abs_img, conf=0.25, iou=0.45, imgsz=1024, device="cpu", verbose=False)
-                if res and len(res) > 0:
-                    cv2.imwrite(out_abs, res[0].plot())
-                    wrote = True
-            except Exception:
-                wrote = False
-
-        if not wrote:
-            shutil.copyfile(abs_img, out_abs)
-
-        input_image_list.append(_urlify(os.path.join("static", "input_img", run_id, rel)))
-        output_image_list.append(_urlify(os.path.join("static", "result", run_id, rel)))
-
-    # ---- Choose best GeoJSON for this run (never blank out a good one) ----
-    chosen_geojson_abs = _pick_geojson_for_run(run_result_dir)
-    if chosen_geojson_abs is None:
-        # create a minimal placeholder ONLY if nothing exists anywhere
-        chosen_geojson_abs = os.path.join(run_result_dir, f"{run_id}.geojson")
-        _save_json(chosen_geojson_abs, {"type": "FeatureCollection", "features": []})
-
-    # Update the public file ONLY by copying a non-empty, valid geojson
-    public_geojson_abs = os.path.join(STATIC_DIR, "output.geojson")
-    if _is_nonempty_geojson(chosen_geojson_abs):
-        _copy(chosen_geojson_abs, public_geojson_abs)
-
-    # ---- Build ZIP of OUTPUTS and include the geojson in the archive ----
-    # If the chosen geojson is not inside the run folder, include it as <run_id>.geojson
-    extras = []
+@csrf_exempt
+@require_http_methods(["POST"])
+def upload_finalize(request: HttpRequest, run_id: str) -> HttpResponse:
+    """Verify the upload (all ranges, sha256) and queue the run like /index does."""
+    session, error = _upload_session(run_id)
+    if error:
+        return error
+    run_input_dir, manifest = session
     try:
-        same_tree = os.path.commonpath([os.path.abspath(run_result_dir), os.path.abspath(chosen_geojson_abs)]) == os.path.abspath(run_result_dir)
-    except Exception:
-        same_tree = False
-    if not same_tree and os.path.exists(chosen_geojson_abs):
-        temp_copy = os.path.join(run_result_dir, f"{run_id}.geojson")
-        try:
-            _copy(chosen_geojson_abs, temp_copy)
-            extras.append(temp_copy)  # if already inside run_result_dir, zip step will pick it anyway
-        except Exception:
-            pass
-
-    zip_rel = os.path.join("static", "zip", f"{run_id}.zip")
-    zip_abs = os.path.join(BASE_DIR, zip_rel)
-    _zip_folder_with_extra(run_result_dir, zip_abs, extras)
+        sha256 = chunked_upload.finalize(run_input_dir, manifest, request.POST.get("sha256", "").strip())
+    except chunked_upload.UploadError as e:
+        return JsonResponse({"status": False, "error": str(e)}, status=e.status)
 
-    # ---- Response ----
+    run_result_dir = os.path.join(RESULT_ROOT, run_id)
+    _ensure(run_result_dir)
+    opts = manifest["options"]
+    job = jobs.enqueue(run_id, opts["model"], opts["model_name"], label=opts["label"],
+                       input_dir=run_input_dir, result_dir=run_result_dir,
+                       options={"output": opts["output"], "source_hashes": {manifest["filename"]: sha256}})
     return JsonResponse({
         "status": True,
         "run_id": run_id,
-        "zip_path": _urlify(zip_rel),
-        "geojson_path": _urlify(os.path.relpath(public_geojson_abs, BASE_DIR)) if os.path.exists(public_geojson_abs) else "",
-        "input_image_list": input_image_list,
-        "output_image_list": output_image_list,
+        "sha256": sha256,
+        "job_status": job.status,
+        "status_url": _urlify(f"jobs/{run_id}/"),
     })
 
+@require_GET
+def job_status(request: HttpRequest, run_id: str) -> HttpResponse:
+    """Status, progress (images done / total) and artifact paths of a queued run."""
+    job = OutputRun.objects.filter(run_id=run_id).first()
+    if job is None:
+        return JsonResponse({"status": False, "error": "not found"}, status=404)
+    return JsonResponse({"status": True, **jobs.job_payload(job)})
+
 # ---------------- HISTORY (filesystem scan) ----------------
 @require_GET
 def runs_history(request: HttpRequest) -> HttpResponse:
@@ -375,14 +344,14 @@ def runs_history(request: HttpRequest) -> HttpResponse:
         run_gj = _pick_geojson_for_run(run_dir) or os.path.join(STATIC_DIR, "output.geojson")
         gj_rel = _urlify(os.path.relpath(run_gj, BASE_DIR)) if os.path.exists(run_gj) else ""
 
+        # archives of older runs were pre-built; newer ones are streamed
         zip_rel = os.path.join("static", "zip", f"{d}.zip")
-        if not os.path.exists(os.path.join(BASE_DIR, zip_rel)):
-            zip_rel = ""
+        zip_url = _urlify(zip_rel) if os.path.exists(os.path.join(BASE_DIR, zip_rel)) else download_url(d)
 
         runs.append({
             "id": d,
             "created_at": datetime.utcfromtimestamp(mtime).isoformat() + "Z",
-            "zip_path": _urlify(zip_rel) if zip_rel else "",
+            "zip_path": zip_url,
             "geojson_path": gj_rel,
             "output_images": outs,
             "input_images": [],
@@ -411,20 +380,32 @@ def runs_history_detail(request: HttpRequest, run_id: str) -> HttpResponse:
     gj_rel = _urlify(os.path.relpath(run_gj, BASE_DIR)) if os.path.exists(run_gj) else ""
 
     zip_rel = os.path.join("static", "zip", f"{run_id}.zip")
-    if not os.path.exists(os.path.join(BASE_DIR, zip_rel)):
-        zip_rel = ""
+    zip_url = _urlify(zip_rel) if os.path.exists(os.path.join(BASE_DIR, zip_rel)) else download_url(run_id)
 
     return JsonResponse({
         "ok": True,
         "run": {
             "id": run_id,
-            "zip_path": _urlify(zip_rel) if zip_rel else "",
+            "zip_path": zip_url,
             "geojson_path": gj_rel,
             "output_images": outs,
             "thumbnail": thumb,
         },
     })
 
+@require_GET
+def run_download(request: HttpRequest, run_id: str) -> HttpResponse:
+    """The run's result folder as a ZIP, built while it is sent (409 while the job is pending)."""
+    run_dir = os.path.join(RESULT_ROOT, run_id)
+    if not chunked_upload.valid_run_id(run_id) or not os.path.isdir(run_dir):
+        return JsonResponse({"ok": False, "error": "not found"}, status=404)
+    job = OutputRun.objects.filter(run_id=run_id).first()  # runs from before the queue have no row
+    if job is not None and job.status in (OutputRun.QUEUED, OutputRun.RUNNING):
+        return JsonResponse({"ok": False, "error": "run is not finished", "job_status": job.status}, status=409)
+    response = StreamingHttpResponse(stream_zip(folder_entries(run_dir)), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{run_id}.zip"'
+    return response
+
 # ---------------- Single GeoJSON helper ----------------
 @csrf_exempt
 def geo_json_path(request: HttpRequest) -> HttpResponse:
@@ -112,33 +112,11 @@ def _load_yolo_model(model_selection: str, model_name: str):
     Load a YOLO .pt from:
       static/models/germany_summer_ai_model/
       static/models/germany_winter_ai_model/
+    Models stay resident in the process-wide registry between requests.
     Returns (model_or_None, chosen_path_or_msg, error_msg)
     """
-    if YOLO is None:
-        return None, "", "ultralytics not installed"
-
-    base = os.path.join(settings.BASE_DIR, "static", "models")
-    model_dir = os.path.join(
-        base, "germany_summer_ai_model" if model_selection == "summer" else "germany_winter_ai_model"
-    )
-
-    if model_name:
-        cand = os.path.join(model_dir, model_name)
-        if not os.path.exists(cand):
-            return None, cand, f"model not found: {cand}"
-        try:
-            return YOLO(cand), cand, ""
-        except Exception as e:
-            return None, cand, f"failed to load model: {e}"
-
-    pts = [f for f in os.listdir(model_dir)] if os.path.isdir(model_dir) else []
-    pts = [os.path.join(model_dir, f) for f in pts if f.lower().endswith(".pt")]
-    if not pts:
-        return None, model_dir, f"no .pt file in {model_dir}"
-    try:
-        return YOLO(pts[0]), pts[0], ""
-    except Exception as e:
-        return None, pts[0], f"failed to load model: {e}"
+    from tree_app.model_registry import registry
+    return registry.get(model_selection, model_name, fallback=not model_name)
 
 def _pick_dir_to_zip(run_result_dir: str) -> str:
     """
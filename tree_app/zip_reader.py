@@ -0,0 +1,137 @@
+"""
+Read uploaded ZIP archives member by member instead of extracting them.
+
+``scan_zip`` indexes an archive once: image members are kept (``__MACOSX``,
+dot-files and anything else are ignored) and each is paired with its
+``.jgw`` sidecar by a name lookup in the archive index. ``iter_members``
+then yields the raw bytes and decoded image of each member straight from
+the archive; nothing is written to disk unless the caller materialises a
+member (``write_member``) because it has to be served back.
+"""
+import os
+import threading
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import cv2  # type: ignore
+except Exception:
+    cv2 = None
+
+from .georef import parse_world_file
+from .pools import ordered_map
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+GEOTIFF_EXTENSIONS = (".tif", ".tiff")
+
+# name: member name in the archive; jgw: member name of its world file (or None)
+ZipMember = namedtuple("ZipMember", ["zip_path", "name", "jgw"])
+
+
+def _is_junk(name: str) -> bool:
+    """macOS resource forks, dot-files and names that would escape the run dir."""
+    parts = name.replace("\\", "/").split("/")
+    return (parts[0] in ("", "__MACOSX") or ":" in parts[0]
+            or any(p.startswith(".") for p in parts))
+
+
+def scan_zip(zip_path: str) -> Tuple[List[ZipMember], List[str]]:
+    """
+    Index an archive: (image members with their .jgw, GeoTIFF member names).
+    Unreadable archives give two empty lists.
+    """
+    try:
+        with zipfile.ZipFile(zip_path, "r") as z:
+            names = [i.filename for i in z.infolist() if not i.is_dir() and not _is_junk(i.filename)]
+    except (OSError, zipfile.BadZipFile):
+        return [], []
+
+    by_lower = {n.lower(): n for n in names}
+    images, tifs = [], []
+    for name in names:
+        low = name.lower()
+        if low.endswith(IMAGE_EXTENSIONS):
+            images.append(ZipMember(zip_path, name, by_lower.get(os.path.splitext(low)[0] + ".jgw")))
+        elif low.endswith(GEOTIFF_EXTENSIONS):
+            tifs.append(name)
+    return images, tifs
+
+
+def decode(data: bytes):
+    """BGR array from encoded image bytes, or None."""
+    if cv2 is None or not data:
+        return None
+    try:
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except Exception:
+        return None
+
+
+def read_geotransform(z: zipfile.ZipFile, member: ZipMember) -> Optional[Tuple[float, ...]]:
+    if not member.jgw:
+        return None
+    try:
+        return parse_world_file(z.read(member.jgw).decode("ascii", "replace"))
+    except (KeyError, zipfile.BadZipFile):
+        return None
+
+
+def iter_members(members: List[ZipMember], decode_images: bool = True,
+                 workers: int = 1) -> Iterator[Tuple[ZipMember, bytes, object, Optional[tuple]]]:
+    """
+    Yield (member, raw bytes, BGR array or None, geotransform or None) in
+    member order.
+
+    With ``workers > 1`` members are inflated and decoded on a thread pool
+    (zlib and the image codecs release the GIL); every thread keeps its own
+    ZipFile handle per archive, since a handle is not safe to share.
+    """
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    def load(m: ZipMember):
+        handles = getattr(local, "handles", None)
+        if handles is None:
+            handles = local.handles = {}
+        z = handles.get(m.zip_path)
+        if z is None:
+            z = handles[m.zip_path] = zipfile.ZipFile(m.zip_path, "r")
+            with lock:
+                opened.append(z)
+        try:
+            data = z.read(m.name)
+        except (KeyError, zipfile.BadZipFile, OSError):
+            data = b""
+        return m, data, decode(data) if decode_images else None, read_geotransform(z, m)
+
+    pool = None
+    try:
+        if workers and workers > 1 and len(members) > 1:
+            pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="unzip")
+            results = ordered_map(pool, load, members, window=2 * workers)
+        else:
+            results = (load(m) for m in members)
+        for r in results:
+            yield r
+    finally:
+        if pool is not None:
+            results.close()
+            pool.shutdown(wait=True)
+        for z in opened:
+            z.close()
+
+
+def write_member(zip_path: str, name: str, dest: str) -> None:
+    """Stream one member to dest (for files GDAL or the browser must read from disk)."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with zipfile.ZipFile(zip_path, "r") as z, z.open(name) as src, open(dest, "wb") as out:
+        while True:
+            buf = src.read(1 << 20)
+            if not buf:
+                break
+            out.write(buf)
@@ -0,0 +1,70 @@
+"""
+ZIP archives generated while they are being sent.
+
+``stream_zip`` writes the archive into a small buffer that is drained after
+every piece of every member, so a download needs about ``chunk_size`` of
+memory however large the run is, and nothing is archived up front. The
+output stream is not seekable, so zipfile uses data descriptors (and ZIP64
+where needed). JPEG/PNG members are stored, since deflate gains nothing on
+them; everything else is deflated.
+"""
+import os
+import zipfile
+from typing import Iterable, Iterator, List, Tuple
+
+_STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".zip", ".gz")
+
+
+class _Sink:
+    """Write-only, non-seekable file object collecting the archive bytes."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def folder_entries(root: str) -> List[Tuple[str, str]]:
+    """(absolute path, archive name) for every file under root, sorted."""
+    entries = []
+    for r, _, files in os.walk(root):
+        for fn in files:
+            abs_f = os.path.join(r, fn)
+            entries.append((abs_f, os.path.relpath(abs_f, root).replace(os.sep, "/")))
+    return sorted(entries, key=lambda e: e[1])
+
+
+def stream_zip(entries: Iterable[Tuple[str, str]], chunk_size: int = 1 << 20) -> Iterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as z:
+        for abs_path, arcname in entries:
+            try:
+                src = open(abs_path, "rb")
+            except OSError:
+                continue  # removed since the listing; skip it
+            with src:
+                info = zipfile.ZipInfo.from_file(abs_path, arcname)
+                info.compress_type = (zipfile.ZIP_STORED if arcname.lower().endswith(_STORED_EXTENSIONS)
+                                      else zipfile.ZIP_DEFLATED)
+                with z.open(info, "w", force_zip64=True) as dst:
+                    for chunk in iter(lambda: src.read(chunk_size), b""):
+                        dst.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()  # central directory
+    if data:
+        yield data
@@ -73,9 +73,62 @@ TEMPLATES = [
 WSGI_APPLICATION = "tree_project.wsgi.application"
 
 # File upload limits (optional — your values are extremely large; keep only if intentional)
-DATA_UPLOAD_MAX_MEMORY_SIZE = 2**31 - 1
+# Uploads never sit in RAM: form fields are capped at Django's default and
+# files above 2.5 MB go to disk (/index spools them straight into the run dir)
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440
 DATA_UPLOAD_MAX_NUMBER_FILES = 1000
-FILE_UPLOAD_MAX_MEMORY_SIZE = 2**31 - 1
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440
+
+# Ceilings for /index uploads (bytes, 0 = unlimited); larger requests get HTTP 413
+UPLOAD_MAX_REQUEST_BYTES = int(os.environ.get("UPLOAD_MAX_REQUEST_BYTES", 20 * 1024**3))
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_FILE_BYTES", 16 * 1024**3))
+
+# Chunk size suggested to clients of the resumable upload API (/uploads/)
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+# Unfinished resumable uploads idle for longer than this are deleted (0 = keep)
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get("UPLOAD_SESSION_TTL_SECONDS", 24 * 3600))
+
+# Loaded YOLO models kept resident between requests (LRU, estimated size)
+YOLO_MODEL_CACHE_MB = int(os.environ.get("YOLO_MODEL_CACHE_MB", 1024))
+
+# Batched inference: images per predict() call and batches decoded ahead
+YOLO_BATCH_SIZE = int(os.environ.get("YOLO_BATCH_SIZE", 8))
+YOLO_PREFETCH_BATCHES = 2
+
+# Worker processes started by `manage.py run_workers`
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# A RUNNING job whose owner has not sent a heartbeat for this long is requeued
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 120))
+
+# Per-job pools below default to this job's share of the CPUs, since
+# JOB_WORKERS jobs run at once
+CPUS_PER_JOB = max(1, (os.cpu_count() or 1) // max(1, JOB_WORKERS))
+
+# Threads reading GeoTIFF tile windows in parallel (1 = sequential)
+TIFF_TILE_WORKERS = int(os.environ.get("TIFF_TILE_WORKERS", CPUS_PER_JOB))
+
+# Threads inflating and decoding images read from uploaded ZIPs (1 = sequential)
+ZIP_DECODE_WORKERS = int(os.environ.get("ZIP_DECODE_WORKERS", min(4, CPUS_PER_JOB)))
+
+# GeoTIFF tiles with less than this fraction of valid (non-nodata) pixels are
+# dropped before inference and listed in the run metadata
+TIFF_MIN_VALID_FRACTION = 0.05
+
+# Reprojected (UTM) copies of uploaded GeoTIFFs, reused across runs; 0 disables
+REPROJECTION_CACHE_DIR = os.path.join(BASE_DIR, "cache", "reprojected")
+REPROJECTION_CACHE_MB = int(os.environ.get("REPROJECTION_CACHE_MB", 10240))
+
+# Raw detections per (tile pixels, weights, conf/iou/imgsz), reused across runs; 0 disables
+DETECTION_CACHE_PATH = os.path.join(BASE_DIR, "cache", "detections.sqlite3")
+DETECTION_CACHE_MB = int(os.environ.get("DETECTION_CACHE_MB", 512))
+
+# Also write each run's features as newline-delimited GeoJSON (<run_id>.geojsonl)
+GEOJSON_SEQ = os.environ.get("GEOJSON_SEQ", "").lower() in {"1", "true", "yes"}
+
+# Path centerlines: buffer distance (m) merging nearby path lines, and worker
+# processes per job (each of the JOB_WORKERS jobs starts its own pool)
+CENTERLINE_TOLERANCE = 10
+CENTERLINE_WORKERS = int(os.environ.get("CENTERLINE_WORKERS", CPUS_PER_JOB))
 
 # Database (SQLite by default)
 DATABASES = {
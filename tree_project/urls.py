@@ -21,6 +21,15 @@ urlpatterns = [
     path("model-upload1/", views.model_upload1, name="model_upload1"),
     path("delete-file/", views.delete_file, name="delete-file"),
     path("geo-json-path/", views.geo_json_path, name="geo-json-path"),
+
+    # background job status for queued /index runs
+    path("jobs/<str:run_id>/", views.job_status, name="job-status"),
+    path("runs/<str:run_id>/download/", views.run_download, name="run-download"),
+
+    # resumable chunked uploads (init -> PUT chunks -> finalize queues the run)
+    path("uploads/", views.upload_init, name="upload-init"),
+    path("uploads/<str:run_id>/", views.upload_chunk, name="upload-chunk"),
+    path("uploads/<str:run_id>/finalize/", views.upload_finalize, name="upload-finalize"),
 ]
 
 # In development, serve the /static/ folder directly (needed for your images/zip/geojson)